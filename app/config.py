@@ -1,10 +1,117 @@
 LOGS_SIZE = 8
 
+LOG_SUMMARY = False # fold the log entries older than the last LOGS_SIZE into per-action success and error counts sent with the logs
+
+LOG_SUMMARY_MAX_TOKENS = 150 # token budget of the log summary, the most failed and most used actions are kept
+
 APPROACH = "ZEROSHOT" # "ZEROSHOT", "AGENTIC"
 
-LLM_ENGINE = "openai" # "openai", these models require a groq api key: "llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768", "gemma-7b-it". They are much cheaper than OpenAI's models.
+AGENT_CONTEXT_MODE = "tools" # if APPROACH = AGENTIC. "tools": the agent reads the books through tool calls. "snapshot": all books are in the prompt, tools are only used to drill down
+
+AGENT_MAX_ITERATIONS = 6 # maximum LLM round trips the agent can make for one decision
+
+AGENT_PARALLEL_TOOL_CALLS = True # let the agent request several books in one round trip
+
+LLM_ENGINE = "openai" # "openai", "mock" (offline simulator, no API key), these models require a groq api key: "llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768", "gemma-7b-it". They are much cheaper than OpenAI's models.
+
+MOCK_LLM_LATENCY = 0.5 # if LLM_ENGINE = "mock": seconds each simulated completion takes
+
+MOCK_LLM_SEED = 0 # if LLM_ENGINE = "mock": changes which action the mock picks for a given prompt
 
 # if LLM_ENGINE = openai
 GPT_ENGINE = "gpt-4o"  # gpt-4o, gpt-4o-mini or gpt-3.5-turbo
 
-LLM_TEMPERATURE = 0.2
\ No newline at end of file
+LLM_TEMPERATURE = 0.2
+
+PROMPT_LAYOUT = "single" # "single": the whole memory in one system message. "split": a byte-stable static prefix followed by the dynamic state, so the provider prompt cache can be hit
+
+STATIC_RECORDS = ["instructions", "actions"] # records sent in full in the static prefix when PROMPT_LAYOUT = "split"
+
+PROMPT_ENCODING = "verbose" # "verbose": every item with its description. "compact": short text lines, owned items only, actions reduced to their prerequisites, record descriptions only in the static prefix. "json": the same content as minified JSON
+
+DECISION_CACHE_ENABLED = False # reuse the decision taken for an identical game state instead of calling the LLM again
+
+DECISION_CACHE_SIZE = 1024 # maximum number of cached decisions
+
+DECISION_CACHE_TTL = 300 # seconds a cached decision stays valid
+
+DECISION_CACHE_LOGS = 3 # trailing log entries that are part of the cached game state
+
+DECISION_CACHE_MAX_TEMPERATURE = 0.3 # the cache is bypassed above this LLM_TEMPERATURE, since decisions are not meant to repeat
+
+OBJECTIVE_GRAPH_FILE = "app/game_settings/objective_graph.json" # objective stages and the items that unlock them
+
+ACTION_PREFILTER = False # only list the actions the current inventory allows in the prompt, based on the recipes in actions.json
+
+LOCAL_FAST_PATH = False # answer forced moves locally without calling the LLM, e.g. drink when thirst is Critical
+
+STATIC_CONFIG_MAX_AGE = 0 # seconds clients may reuse /messages/ and /xp/ without asking. 0: they revalidate every time, and get a 304 with the ETag when nothing changed
+
+STATIC_CONFIG_RELOAD_INTERVAL = 1.0 # seconds between two checks of the modification time of the files served by /messages/ and /xp/
+
+BATCH_MAX_SIZE = 500 # maximum number of requests accepted by /next_actions/
+
+BATCH_MAX_CONCURRENCY = 32 # turns of a /next_actions/ batch played at the same time
+
+# Connection pool shared by all the requests to the LLM provider
+LLM_POOL_MAX_CONNECTIONS = 100
+
+LLM_POOL_MAX_KEEPALIVE = 20 # idle connections kept open for reuse
+
+LLM_POOL_KEEPALIVE_EXPIRY = 30.0 # seconds an idle connection is kept open
+
+LLM_TIMEOUT = 60.0 # seconds, for the whole LLM request
+
+LLM_CONNECT_TIMEOUT = 5.0 # seconds, to establish a connection
+
+WARMUP_ENABLED = True # on startup, load the settings, the tokenizer and the clients of the configured engines (and the agent if APPROACH = AGENTIC) before serving
+
+WARMUP_TOKENIZER = True # load the tiktoken BPE file during the warm-up, it is downloaded on first use if not cached locally
+
+LLM_FALLBACK_ENGINES = [] # engines tried in order when LLM_ENGINE fails or its circuit is open, e.g. ["llama3-70b-8192"]
+
+LLM_RETRY_ATTEMPTS = 3 # attempts per engine for transient errors: timeouts, connection errors, rate limits, 5xx
+
+LLM_RETRY_BASE_WAIT = 0.5 # seconds, scale of the jittered exponential backoff between two attempts
+
+LLM_RETRY_MAX_WAIT = 8.0 # seconds, longest wait between two attempts
+
+CIRCUIT_FAILURE_THRESHOLD = 5 # consecutive failures after which an engine is skipped
+
+CIRCUIT_RESET_TIMEOUT = 30.0 # seconds an engine is skipped before a trial call is let through
+
+LLM_HEDGE_ENABLED = False # call the first fallback engine too when LLM_ENGINE is slower than usual, and use the first answer
+
+LLM_HEDGE_QUANTILE = 0.95 # latency quantile of LLM_ENGINE after which the hedged call is sent
+
+LLM_HEDGE_MIN_SAMPLES = 20 # completions measured before the quantile is used
+
+LLM_HEDGE_DEFAULT_DELAY = 5.0 # seconds before the hedged call until LLM_HEDGE_MIN_SAMPLES completions are measured
+
+RATE_LIMITS = {} # client-side quotas per model, e.g. {"gpt-4o": {"rpm": 500, "tpm": 30000}}. Models without an entry are not limited
+
+RATE_LIMIT_MAX_QUEUE = 100 # LLM calls waiting for the quota of a model, further calls are shed
+
+RATE_LIMIT_MAX_WAIT = 10.0 # seconds a call may wait for the quota before it is shed
+
+STATE_BACKEND = "file" # "file", "memory", "sqlite". Where the game sessions are stored.
+
+STATE_DB_URL = "sqlite:///app/settings/state.db" # if STATE_BACKEND = sqlite
+
+DEFAULT_SESSION_ID = "default" # session used when a request does not carry a session id. With the file backend it maps to the files in app/settings
+
+STATE_DURABILITY = "interval" # "sync", "interval", "on_shutdown". How the in-memory game state is flushed to the settings files.
+
+STATE_FLUSH_INTERVAL = 1.0 # seconds between background flushes of dirty records when STATE_DURABILITY = "interval"
+
+STATE_MAX_SESSIONS = 1000 # game sessions kept in memory. Beyond it the least recently used one is flushed and dropped, it is loaded again from the backend when played. 0 keeps every session
+
+LOGS_JOURNAL = False # with the file backend, append new log entries to logs.journal instead of rewriting logs.json on every turn
+
+JOURNAL_CHECKPOINT_EVERY = 100 # journaled entries after which logs.json is rewritten and the journal truncated
+
+STATE_SHARED = False # several workers or nodes serve the same sessions (uvicorn --workers N): sessions are versioned, reloaded when another worker changed them and written at the end of each turn. Needs the "sqlite" backend, or the "file" backend on POSIX
+
+STATE_DB_BUSY_TIMEOUT = 5.0 # seconds a sqlite write waits for the write of another worker
+
+METRICS_PUBLISH_INTERVAL = 5.0 # with STATE_SHARED, seconds between two publications of the worker metrics to the state backend. /metrics sums the metrics of every worker
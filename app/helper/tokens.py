@@ -0,0 +1,81 @@
+from functools import lru_cache
+from app import config
+
+# Encoding used for models tiktoken does not know about, e.g. the Groq hosted llama, mixtral and gemma models.
+# Their tokenizers differ from OpenAI's, cl100k_base is a close enough estimate for prompt sizing.
+FALLBACK_ENCODING = "cl100k_base"
+
+
+def default_model():
+    """
+    Returns the model configured for the ZEROSHOT decisions.
+
+    Returns:
+    --------
+    str
+        config.GPT_ENGINE when the OpenAI engine is selected, the Groq model name otherwise.
+    """
+    return config.GPT_ENGINE if config.LLM_ENGINE == "openai" else config.LLM_ENGINE
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name):
+    """
+    Returns the tiktoken encoding with the given name, loading it only once per process.
+
+    Parameters:
+    -----------
+    encoding_name : str
+        The name of the encoding, e.g. "cl100k_base".
+
+    Returns:
+    --------
+    tiktoken.Encoding
+        The encoding.
+    """
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=None)
+def encoding_for_model(model):
+    """
+    Returns the tiktoken encoding used by a model, loading it only once per process.
+
+    Parameters:
+    -----------
+    model : str
+        The name of the model.
+
+    Returns:
+    --------
+    tiktoken.Encoding
+        The encoding of the model, or the fallback encoding if tiktoken does not know the model.
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return get_encoding(FALLBACK_ENCODING)
+
+
+def num_tokens(string, model=None, encoding_name=None):
+    """
+    Returns the number of tokens in a text string.
+
+    Parameters:
+    -----------
+    string : str
+        The text to count the tokens of.
+    model : str, optional
+        The model whose encoding is used. Defaults to the configured model.
+    encoding_name : str, optional
+        An explicit encoding to use instead of the model encoding.
+
+    Returns:
+    --------
+    int
+        The number of tokens in the text string.
+    """
+    encoding = get_encoding(encoding_name) if encoding_name else encoding_for_model(model or default_model())
+    return len(encoding.encode(string))
@@ -1,5 +1,46 @@
 import json
 import os
+import tempfile
+
+def atomic_write(file_path, payload):
+    """
+    Writes text to a file atomically.
+
+    The payload is written to a temporary file in the same directory, flushed to disk and then
+    renamed over the target, so readers only ever see the previous or the new content, never a
+    truncated file.
+
+    Parameters:
+    -----------
+    file_path : str or Path
+        Path to the file to write.
+    payload : str
+        Text to write to the file.
+    """
+    file_path = os.fspath(file_path)
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            # mkstemp creates the file with 0600, keep the permissions of the file being replaced
+            os.chmod(tmp_path, os.stat(file_path).st_mode & 0o777)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    # Persist the rename itself. Directories cannot be opened this way on Windows.
+    if os.name == "posix":
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
 def load_from_json(category_name, file_path):
     """
@@ -44,8 +85,7 @@ def save_to_json(category_name, file_path, data):
             existing_data = json.load(file)
 
     existing_data[category_name] = data
-    with open(file_path, 'w') as file:
-        json.dump(existing_data, file, indent=2)
+    atomic_write(file_path, json.dumps(existing_data, indent=2))
 
 def load_categories_from_json(file_path):
     """
@@ -76,5 +116,4 @@ def save_categories_to_json(file_path, categories):
     categories : list of dict
         A list of categories, where each category is represented as a dictionary.
     """
-    with open(file_path, 'w') as file:
-        json.dump(categories, file, indent=2)
+    atomic_write(file_path, json.dumps(categories, indent=2))
@@ -1,50 +1,154 @@
+import time
+_imports_started = time.perf_counter()
+import asyncio
 import logging
-from fastapi import FastAPI, Body, HTTPException
-from app.validation.pydantic_val import ActionRequest  # Pydantic models for request and response
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Body, HTTPException, Query, Request
+from app.validation.pydantic_val import ActionRequest, SESSION_ID_PATTERN  # Pydantic models for request and response
 from app import config  # Configuration settings
-from fastapi.responses import JSONResponse  # JSON response for error handling
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse  # JSON response for error handling
+from fastapi.concurrency import run_in_threadpool
 from app.settings.settings_manager import SettingsManager
+from app.settings.state_store import get_state_store, close_state_store, StateConflictError
 from services.decisions import Decision
+from services.client_pool import aclose_clients
+from app.services.decision_cache import get_decision_cache
+from app.services.objective_graph import get_objective_graph
+from app.services.action_rules import is_critical
+from app.services import metrics
 import json
-from app.helper.utils import load_from_json
+from app.services.warmup import get_startup_profile, warm_up
+from app.services.static_config import cache_control, get_static_config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+get_startup_profile().add("imports", time.perf_counter() - _imports_started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the shared game state and warm up the configured engines on startup, then flush pending
+    changes and close the LLM clients on shutdown.
+    """
+    get_state_store("app/settings")
+    get_objective_graph().subscribe(metrics.count_transition)
+    if config.WARMUP_ENABLED:
+        warm_up("app/settings")
+    get_startup_profile().log()
+    yield
+    close_state_store()
+    await aclose_clients()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/startup/")
+def get_startup():
+    """
+    Endpoint returning the startup profile: the duration and status of the imports and of each warm-up step.
+    """
+    return get_startup_profile().report()
 
-# Global variable to store the total tokens consumed
-total_tokens = 0
+def _static_config_response(category, request: Request):
+    """
+    Serve a game settings file from the static config cache.
 
-@app.get("/messages/")
-def get_messages():
-    messages_file = "app/game_settings/messages.json"
+    Parameters:
+    - category: The STATIC_CONFIG_FILES key of the file
+    - request: The request, whose If-None-Match header is compared with the ETag of the file
+
+    Returns:
+    - The JSON value of the file, or an empty 304 response when the client already has it
+    """
+    static_file = get_static_config(category)
     try:
-        loadjson = load_from_json("messages", messages_file)
-        if loadjson:
-            logger.info(f"Messages loaded successfully")
-            return loadjson
+        body, etag = static_file.get()
     except Exception as e:
         logger.error(f"Error processing request: {e}")
-        return JSONResponse(status_code=500, content={"message":str(e)})
-    
+        return JSONResponse(status_code=500, content={"message": str(e)})
+    headers = {"ETag": etag, "Cache-Control": cache_control()}
+    if static_file.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/messages/")
+def get_messages(request: Request):
+    """
+    Endpoint returning the result message templates of the game.
+    """
+    return _static_config_response("messages", request)
 
 @app.get("/xp/")
-def get_messages():
-    messages_file = "app/game_settings/xp.json"
-    try:
-        return load_from_json("xp", messages_file)
-    except Exception as e:
-        logger.error(f"Error processing request: {e}")
-        return JSONResponse(status_code=500, content={"message":str(e)})
-    
+def get_xp(request: Request):
+    """
+    Endpoint returning the experience points granted per action result.
+    """
+    return _static_config_response("xp", request)
 
-@app.post("/next_action/")
-def get_next_action(action_request: ActionRequest = Body(...)):
+
+def _prepare_turn(action_request: ActionRequest):
     """
-    Endpoint to determine the next action based on the request.
+    Apply the received action to the session state and build the prompt.
+
+    This may load the session from the state backend, so it runs in the threadpool.
+
+    Returns:
+    - settings_manager: The SettingsManager bound to the session
+    - message: The message of the executed action
+    - memory: The prompt messages for the ZEROSHOT approach, the books snapshot for the AGENTIC
+      snapshot mode, None otherwise
+    - prompt_tokens: The number of tokens of the prompt, 0 for the AGENTIC approach
+    - cache_key: The state fingerprint when the decision cache is enabled, None otherwise
+    - forced: The (action, observation) decided locally when config.LOCAL_FAST_PATH is enabled
+      and the move is forced, None otherwise. No prompt is built in that case
+    - books: The JSON of every record for the AGENTIC approach, None otherwise. It is taken in the
+      turn's transaction, so the read_book tool sees the same state as the prompt
+    """
+    with metrics.span("state_load"):
+        store = get_state_store("app/settings")
+        settings_manager = SettingsManager(settings_dir="app/settings", store=store, session_id=action_request.session_id)
+
+    memory = None
+    prompt_tokens = 0
+    cache_key = None
+    forced = None
+    books = None
+    with store.transaction(settings_manager.session):
+        with metrics.span("state_update"):
+            # check and update the objectives
+            settings_manager.updateObjectives(action_request.inventory)
+
+            # Update memory with the received action request
+            message = settings_manager.update_memory(action_request)
+
+        if config.LOCAL_FAST_PATH:
+            forced = settings_manager.forced_action()
+            if forced is not None:
+                return settings_manager, message, memory, prompt_tokens, cache_key, forced, books
+
+        if config.APPROACH == "AGENTIC":
+            with metrics.span("prompt_build"):
+                if config.AGENT_CONTEXT_MODE == "snapshot":
+                    memory = settings_manager.all_records_to_string()
+                books = settings_manager.records_json()
+
+        if config.APPROACH == "ZEROSHOT":
+            with metrics.span("prompt_build"):
+                memory = settings_manager.prompt_messages()
+            with metrics.span("tokenize"):
+                prompt_tokens = settings_manager.prompt_tokens()
+            if config.DECISION_CACHE_ENABLED:
+                cache_key = settings_manager.state_fingerprint()
+
+    return settings_manager, message, memory, prompt_tokens, cache_key, forced, books
+
+
+async def _run_turn(action_request: ActionRequest):
+    """
+    Play one turn: update the session with the received action and decide the next one.
 
     Parameters:
     - action_request: The request body containing the action details
@@ -52,108 +156,366 @@ def get_next_action(action_request: ActionRequest = Body(...)):
     Returns:
     - action: The next action to be performed
     - observation: The observation related to the action
+
+    Raises:
+    - HTTPException: 404 if the session does not exist, 409 if another worker changed it during the turn
+    - Exception: Any error raised while making the decision
     """
 
-    global total_tokens  # Declare the use of the global variable
-    
-    # Log the received request data
-    logger.info(f"Received request: {action_request}")
+    labels = metrics.turn_labels()
 
-    settings_manager = SettingsManager(settings_dir="app/settings")
-    
-    # check and update the objectives
-    objectives = settings_manager.updateObjectives(action_request.inventory)
+    try:
+        settings_manager, message, memory, prompt_tokens, cache_key, forced, books = await run_in_threadpool(_prepare_turn, action_request)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except StateConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    # Update memory with the received action request
-    message = settings_manager.update_memory(action_request)
+    if forced is not None:
+        action, observation = forced
+        metrics.TURNS.inc(outcome="forced", **labels)
+        logger.info(f"Forced move decided locally: {action}")
+        return action, observation
 
     # Process based on the configured approach
     if config.APPROACH == "ZEROSHOT":
+        decision_cache = get_decision_cache()
+        next_action = decision_cache.get(cache_key) if cache_key else None
+        if next_action is not None:
+            return _finish_decision(settings_manager, message, next_action, "cache", prompt_tokens, {}, cache_key, labels)
 
-        memory = settings_manager.all_records_to_string()
-        total_tokens = total_tokens + settings_manager.num_tokens(memory)
+        metrics.LLM_TOKENS.inc(prompt_tokens, kind="estimated_prompt", **labels)
+
+        # Get the next action from Decision class
+        decisions = Decision(memory, prompt_tokens, _is_critical(action_request))
+        with metrics.span("llm_call", **labels):
+            next_action = await decisions.aget_next_action()
+        return _finish_decision(settings_manager, message, next_action, "llm", prompt_tokens, decisions.usage, cache_key,
+                                metrics.turn_labels(decisions.engine))
 
-        try:
-            # Get the next action from Decision class
-            decisions = Decision(memory)
-            next_action = decisions.get_next_action()
-            #logger.info(f"Next action: {next_action}")
-            # Parse the next action JSON string into a dictionary
-            next_action_dict = json.loads(next_action)
-            action = next_action_dict.get("action")
-            observation = next_action_dict.get("observation")
-            logger.info (f"\n\n============= \nTOKENS: {settings_manager.num_tokens(memory)}\nTOTAL TOKENS: {total_tokens}\n=============\nACTION: {action}\nOBSERVATION: {observation}\n=============\nMESSAGE: {message}\n=============\n")
-            return action, observation
-        
-        except Exception as e:
-            # Log the error
-            logger.error(f"Error occurred while getting next action: {str(e)}")
-            # Return an error response
-            return JSONResponse(
-                status_code=500,
-                content={
-                    "message": "An error occurred while making a new decision",
-                    "error": str(e)
-                }
-            )
     elif config.APPROACH == "AGENTIC":
-        from services.agent import SurvivalGameAgent
+        from services.agent import get_agent
 
-        agent = SurvivalGameAgent()
-        agent.initialize_agent()
+        agent = get_agent()
 
         # Input data for the agent
         input_data = {
             "input": "Return only a JSON object with the next action and observation (no other information added). The action should be only 1 of the actions in the actions book. You can't use other actions",
             "chat_history": []
         }
+        if memory is not None:
+            input_data["books"] = memory
+        with metrics.span("llm_call", **labels):
+            action, observation = await agent.aexecute_agent(input_data, books)
+        metrics.TURNS.inc(outcome="llm" if action else "error", **labels)
+        logger.info (f"Action: {action}, Observation: {observation}")
+        return action, observation
+
+
+def _finish_decision(settings_manager, message, next_action, outcome, prompt_tokens, usage, cache_key, labels):
+    """
+    Record a ZEROSHOT decision: cache it, count it and log it.
+
+    Parameters:
+    - settings_manager: The SettingsManager bound to the session
+    - message: The message of the executed action
+    - next_action: The decision as a JSON string
+    - outcome: "llm" if the decision was just taken, "cache" if it was served from the decision cache
+    - prompt_tokens: The locally counted prompt tokens
+    - usage: The token usage reported by the provider
+    - cache_key: The state fingerprint, None when the decision cache is disabled
+    - labels: The metric labels of the turn
+
+    Returns:
+    - action: The next action to be performed
+    - observation: The observation related to the action
+    """
+    # Parse the next action JSON string into a dictionary
+    next_action_dict = json.loads(next_action)
+    action = next_action_dict.get("action")
+    observation = next_action_dict.get("observation")
+
+    if outcome == "llm":
+        metrics.record_usage(usage, **labels)
+        if cache_key and action:
+            get_decision_cache().put(cache_key, next_action)
+    metrics.TURNS.inc(outcome=outcome if action else "error", **labels)
+    logger.info(
+        "Turn decided: session=%s outcome=%s action=%s prompt_tokens=%d completion_tokens=%d cached_tokens=%d message=%r observation=%r",
+        settings_manager.session_id, outcome, action, prompt_tokens, usage.get("completion_tokens", 0),
+        usage.get("cached_tokens", 0), message, observation,
+    )
+    return action, observation
+
+
+def _is_critical(action_request: ActionRequest):
+    """
+    Tells whether any stat of the player is Critical, so its LLM call is served first when rate limited.
+    """
+    return any(is_critical(level) for level in action_request.player_info.model_dump().values())
+
+
+def _turn_error_message():
+    """
+    Returns the error message of a failed turn for the configured approach.
+    """
+    if config.APPROACH == "AGENTIC":
+        return "An error occurred while executing the agent"
+    return "An error occurred while making a new decision"
+
+
+@app.post("/next_action/")
+async def get_next_action(action_request: ActionRequest = Body(...)):
+    """
+    Endpoint to determine the next action based on the request.
+
+    Parameters:
+    - action_request: The request body containing the action details
+
+    Returns:
+    - action: The next action to be performed
+    - observation: The observation related to the action
+    """
+    
+    # Log the received request data
+    logger.info(f"Received request: {action_request}")
+
+    try:
+        return await _run_turn(action_request)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        metrics.TURNS.inc(outcome="error", **metrics.turn_labels())
+        # Log the error
+        logger.error(f"Error occurred while getting next action: {str(e)}")
+        # Return an error response
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": _turn_error_message(),
+                "error": str(e)
+            }
+        )
+
+
+def _sse(event, data):
+    """
+    Format a server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _decided_events(action, observation):
+    """
+    Server-sent events of a decision that is already taken.
+    """
+    yield _sse("action", {"action": action})
+    yield _sse("observation", {"observation": observation})
+    yield _sse("done", {"action": action, "observation": observation})
+
+
+@app.post("/next_action/stream/")
+async def stream_next_action(action_request: ActionRequest = Body(...)):
+    """
+    Streaming version of /next_action/, as server-sent events.
+
+    With the ZEROSHOT approach the completion is streamed from the provider and the action is
+    sent as soon as it is complete and found in the actions catalogue, before the observation is
+    generated. Forced moves, cached decisions and the AGENTIC approach send every event at once.
+    If the validated completion ends up with another action than the one sent early, a second
+    action event carries the final one, which is also the one in done. An error once the stream
+    has started, a failed completion, or a final action missing from the catalogue is sent as an
+    error event instead of the observation and done events.
+
+    Parameters:
+    - action_request: The request body containing the action details
+
+    Returns:
+    - A text/event-stream with the events:
+      - action: {"action": ...}
+      - observation: {"observation": ...}
+      - done: {"action": ..., "observation": ...}
+      - error: {"message": ..., "error": ...}, instead of the remaining events
+    """
+
+    logger.info(f"Received streaming request: {action_request}")
+
+    if config.APPROACH != "ZEROSHOT":
+        try:
+            action, observation = await _run_turn(action_request)
+        except HTTPException:
+            raise
+        except Exception as e:
+            metrics.TURNS.inc(outcome="error", **metrics.turn_labels())
+            logger.error(f"Error occurred while getting next action: {str(e)}")
+            return JSONResponse(status_code=500, content={"message": _turn_error_message(), "error": str(e)})
+        return StreamingResponse(_decided_events(action, observation), media_type="text/event-stream")
+
+    labels = metrics.turn_labels()
+    try:
+        settings_manager, message, memory, prompt_tokens, cache_key, forced, _ = await run_in_threadpool(_prepare_turn, action_request)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except StateConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if forced is not None:
+        metrics.TURNS.inc(outcome="forced", **labels)
+        logger.info(f"Forced move decided locally: {forced[0]}")
+        return StreamingResponse(_decided_events(*forced), media_type="text/event-stream")
+
+    next_action = get_decision_cache().get(cache_key) if cache_key else None
+    if next_action is not None:
+        decided = _finish_decision(settings_manager, message, next_action, "cache", prompt_tokens, {}, cache_key, labels)
+        return StreamingResponse(_decided_events(*decided), media_type="text/event-stream")
+
+    catalogue = set(settings_manager.action_rules().rules)
+
+    async def events():
         try:
-            action, observation = agent.execute_agent(input_data)
-            logger.info (f"Action: {action}, Observation: {observation}")
-            return action, observation
-        
+            metrics.LLM_TOKENS.inc(prompt_tokens, kind="estimated_prompt", **labels)
+            decisions = Decision(memory, prompt_tokens, _is_critical(action_request))
+            start = time.perf_counter()
+            sent_action = None
+            next_action = None
+            async for kind, value in decisions.astream_next_action():
+                if kind == "action":
+                    if value in catalogue:
+                        sent_action = value
+                        yield _sse("action", {"action": value})
+                else:
+                    next_action = value
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_call", **labels)
+            if decisions.ttft is not None:
+                metrics.STAGE_SECONDS.observe(decisions.ttft, stage="llm_ttft", **labels)
+
+            action, observation = _finish_decision(settings_manager, message, next_action, "llm", prompt_tokens,
+                                                   decisions.usage, cache_key, metrics.turn_labels(decisions.engine))
+            if not action or action not in catalogue:
+                # A failed call, an invalid completion or an action the game does not know
+                error = observation if not action else f"The action {action} is not in the actions catalogue"
+                yield _sse("error", {"message": _turn_error_message(), "error": error})
+                return
+            if action != sent_action:
+                # Nothing was sent early, or the validated completion disagrees with it: this action replaces it
+                yield _sse("action", {"action": action})
+            yield _sse("observation", {"observation": observation})
+            yield _sse("done", {"action": action, "observation": observation})
         except Exception as e:
-            logger.error(f"Error occurred while executing agent: {str(e)}")
-            return JSONResponse(
-                status_code=500,
-                content={
-                    "message": "An error occurred while executing the agent",
-                    "error": str(e)
-                }
-            )
+            metrics.TURNS.inc(outcome="error", **labels)
+            logger.error(f"Error occurred while streaming next action: {str(e)}")
+            yield _sse("error", {"message": _turn_error_message(), "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/next_actions/")
+async def get_next_actions(action_requests: List[ActionRequest] = Body(...)):
+    """
+    Endpoint to determine the next action of many games in one request.
+
+    The turns run concurrently, at most config.BATCH_MAX_CONCURRENCY at a time. Requests for
+    the same session are played one after the other, in the order they were sent.
+
+    Parameters:
+    - action_requests: The list of requests, each tagged with its session_id
+
+    Returns:
+    - A list with one result per request, in the request order. Each result holds the
+      session_id, action, observation and error (None when the turn succeeded)
+    """
+
+    if len(action_requests) > config.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"A batch can hold at most {config.BATCH_MAX_SIZE} requests.")
+
+    logger.info(f"Received batch of {len(action_requests)} requests")
+
+    semaphore = asyncio.Semaphore(config.BATCH_MAX_CONCURRENCY)
+    results = [None] * len(action_requests)
+
+    # Group the requests by session so the turns of a session never overlap
+    sessions: Dict[str, List[int]] = {}
+    for index, action_request in enumerate(action_requests):
+        sessions.setdefault(action_request.session_id or config.DEFAULT_SESSION_ID, []).append(index)
+
+    async def play_session(indexes):
+        for index in indexes:
+            action_request = action_requests[index]
+            result = {"session_id": action_request.session_id, "action": None, "observation": None, "error": None}
+            async with semaphore:
+                try:
+                    result["action"], result["observation"] = await _run_turn(action_request)
+                except HTTPException as e:
+                    result["error"] = e.detail
+                except Exception as e:
+                    metrics.TURNS.inc(outcome="error", **metrics.turn_labels())
+                    logger.error(f"Error occurred while getting next action for session {action_request.session_id}: {str(e)}")
+                    result["error"] = f"{_turn_error_message()}: {str(e)}"
+            results[index] = result
+
+    await asyncio.gather(*(play_session(indexes) for indexes in sessions.values()))
+    return results
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Endpoint exposing the service metrics in the Prometheus text format.
+
+    Returns:
+    - Per-stage latency histograms, token and turn counters per engine, model and approach,
+      the decision cache stats and the agent round-trip stats. With config.STATE_SHARED the
+      counters and histograms are summed over every worker, the collected stats are this worker's
+    """
+    if config.STATE_SHARED:
+        snapshots = get_state_store("app/settings").shared_metrics()
+        return PlainTextResponse(metrics.REGISTRY.render(snapshots), media_type="text/plain; version=0.0.4")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 
 @app.post("/start_new_game/")
-def start_new_game():
+def start_new_game(session_id: Optional[str] = Query(default=None, pattern=SESSION_ID_PATTERN)):
     """
     Endpoint to start a new game.
 
+    Parameters:
+    - session_id: Optional session to (re)start. A new session is created when omitted
+
     Returns:
     - message: The message to be displayed to the user
+    - session_id: The session to pass to /next_action/
     """
 
-    settings_manager = SettingsManager(settings_dir="app/settings")
+    store = get_state_store("app/settings")
 
     try:
-        # Clear the logs, current_plan, warnings and game_info
-        settings_manager.reset_record("logs")
-        settings_manager.reset_record("game_info")
-        settings_manager.reset_record("objectives")
+        if session_id is None:
+            session = store.create_session()
+        else:
+            session = store.get_session(session_id, create=True)
+        settings_manager = SettingsManager(settings_dir="app/settings", store=store, session_id=session.session_id)
 
-        # Reset the inventory quantities
-        settings_manager.reset_inventory_quantities()
+        with store.transaction(session):
+            # Clear the logs, current_plan, warnings and game_info
+            settings_manager.reset_record("logs")
+            settings_manager.reset_record("game_info")
 
-        # Reset the player info
-        settings_manager.set_player_info_to_very_good()
+            # Reset the inventory quantities
+            settings_manager.reset_inventory_quantities()
 
-        # Add the first objective
-        first_objective = {
-            "name": "Build Shelter",
-            "description": "Build a shelter to protect yourself from the elements, have fire and a place to sleep."
-        }
-        settings_manager.add_item('objectives', first_objective)
+            # Reset the player info
+            settings_manager.set_player_info_to_very_good()
+
+            # Set the first objective of the objective graph
+            settings_manager.records["objectives"]["data"]["objectives"] = [get_objective_graph().first()]
+            settings_manager.save_record("objectives")
 
-        return {"message": "New game started successfully"}
+        return {"message": "New game started successfully", "session_id": session.session_id}
     
+    except StateConflictError as e:
+        logger.error(f"StateConflictError: {e}")
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         logger.error(f"ValueError: {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -163,13 +525,3 @@ def start_new_game():
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
-
-
-@app.get("/xp/")
-def get_messages():
-    messages_file = "app/game_settings/xp.json"
-    try:
-        return load_from_json("xp", messages_file)
-    except Exception as e:
-        logger.error(f"Error processing request: {e}")
-        return JSONResponse(status_code=500, content={"message":str(e)})
\ No newline at end of file
@@ -0,0 +1,241 @@
+import re
+
+# Words used in the action descriptions that differ from the inventory item names
+ITEM_ALIASES = {
+    "fibre": "fibers",
+    "fibres": "fibers",
+    "fiber": "fibers",
+}
+
+# Prerequisites the action descriptions do not spell out as "You need ..." recipes
+RULE_OVERRIDES = {
+    "eat": {"any_of": ["berry", "fish"]},
+    "mine_gold": {"tools": ["pickaxe"]},
+    "mine_iron": {"tools": ["pickaxe"]},
+}
+
+# Level of a player_info stat that forces the next move
+CRITICAL_LEVEL = "critical"
+
+RECIPE_PATTERN = re.compile(r"you need (.+)$", re.IGNORECASE)
+INGREDIENT_PATTERN = re.compile(r"(\d+)\s+([a-z]+)", re.IGNORECASE)
+TOOL_PATTERN = re.compile(r"(\w+) is needed", re.IGNORECASE)
+
+
+class ActionRule:
+    """
+    Prerequisites of a single action, checked against the inventory.
+
+    Attributes:
+    -----------
+    name : str
+        The name of the action.
+    ingredients : dict
+        Quantity of each item consumed by the action, keyed by inventory item name.
+    tools : list of str
+        Items that must be owned but are not consumed.
+    any_of : list of str
+        Items of which at least one must be owned, e.g. the food for eat.
+    """
+
+    def __init__(self, name, ingredients=None, tools=None, any_of=None):
+        self.name = name
+        self.ingredients = ingredients or {}
+        self.tools = tools or []
+        self.any_of = any_of or []
+
+    def missing(self, inventory):
+        """
+        Lists what the inventory lacks to perform the action.
+
+        Parameters:
+        -----------
+        inventory : dict
+            Quantity owned of each item, keyed by item name.
+
+        Returns:
+        --------
+        list of str
+            One entry per missing prerequisite, empty if the action is feasible.
+        """
+        missing = []
+        for item, quantity in self.ingredients.items():
+            owned = inventory.get(item, 0)
+            if owned < quantity:
+                missing.append(f"{quantity - owned} {item}")
+        for tool in self.tools:
+            if inventory.get(tool, 0) < 1:
+                missing.append(tool)
+        if self.any_of and not any(inventory.get(item, 0) > 0 for item in self.any_of):
+            missing.append(" or ".join(self.any_of))
+        return missing
+
+    def is_feasible(self, inventory):
+        """
+        Tells whether the inventory holds every prerequisite of the action.
+
+        Parameters:
+        -----------
+        inventory : dict
+            Quantity owned of each item, keyed by item name.
+
+        Returns:
+        --------
+        bool
+            True if nothing is missing.
+        """
+        return not self.missing(inventory)
+
+
+class ActionRules:
+    """
+    Recipe and prerequisite table of the actions catalogue.
+
+    The recipes are parsed from the action descriptions in actions.json ("To craft a axe you need
+    2 sticks and 1 stone", "Axe is needed") and completed with RULE_OVERRIDES.
+    """
+
+    def __init__(self, rules):
+        """
+        Initializes the table.
+
+        Parameters:
+        -----------
+        rules : list of ActionRule
+            The rules, in the catalogue order.
+        """
+        self.rules = {rule.name: rule for rule in rules}
+
+    @classmethod
+    def from_catalogue(cls, actions, item_names):
+        """
+        Builds the table from the actions catalogue.
+
+        Parameters:
+        -----------
+        actions : list of dict
+            The actions, each with a name and a description.
+        item_names : iterable of str
+            The inventory item names the recipe words are normalized to.
+
+        Returns:
+        --------
+        ActionRules
+            The prerequisite table.
+        """
+        item_names = set(item_names)
+        rules = []
+        for action in actions:
+            description = action.get("description", "")
+            ingredients = {}
+            for sentence in description.split("."):
+                recipe = RECIPE_PATTERN.search(sentence.strip())
+                if recipe:
+                    for quantity, word in INGREDIENT_PATTERN.findall(recipe.group(1)):
+                        item = normalize_item(word, item_names)
+                        ingredients[item] = ingredients.get(item, 0) + int(quantity)
+            tools = [normalize_item(word, item_names) for word in TOOL_PATTERN.findall(description)]
+            override = RULE_OVERRIDES.get(action["name"], {})
+            rules.append(ActionRule(
+                action["name"],
+                ingredients,
+                tools + override.get("tools", []),
+                override.get("any_of"),
+            ))
+        return cls(rules)
+
+    def feasible(self, inventory):
+        """
+        Returns the actions the inventory allows, in the catalogue order.
+
+        Parameters:
+        -----------
+        inventory : dict
+            Quantity owned of each item, keyed by item name.
+
+        Returns:
+        --------
+        tuple of str
+            The names of the feasible actions.
+        """
+        return tuple(name for name, rule in self.rules.items() if rule.is_feasible(inventory))
+
+    def is_feasible(self, action, inventory):
+        """
+        Tells whether an action of the catalogue can be performed with the inventory.
+
+        Parameters:
+        -----------
+        action : str
+            The name of the action.
+        inventory : dict
+            Quantity owned of each item, keyed by item name.
+
+        Returns:
+        --------
+        bool
+            True if the action exists and nothing is missing.
+        """
+        rule = self.rules.get(action)
+        return rule is not None and rule.is_feasible(inventory)
+
+    def forced_action(self, player_info, inventory):
+        """
+        Returns the move the player state leaves no choice about, if any.
+
+        A Critical thirst forces drink, then a Critical hunger forces eat when there is food.
+
+        Parameters:
+        -----------
+        player_info : dict
+            Level of each player stat, keyed by stat name.
+        inventory : dict
+            Quantity owned of each item, keyed by item name.
+
+        Returns:
+        --------
+        tuple of (str, str) or None
+            The action and its observation, or None if the LLM has to decide.
+        """
+        if is_critical(player_info.get("thirst")) and self.is_feasible("drink", inventory):
+            return "drink", "My thirst is critical, I need to drink water right away."
+        if is_critical(player_info.get("hunger")) and self.is_feasible("eat", inventory):
+            return "eat", "My hunger is critical and I have food, I need to eat right away."
+        return None
+
+
+def normalize_item(word, item_names):
+    """
+    Maps a word of an action description to an inventory item name.
+
+    Parameters:
+    -----------
+    word : str
+        The word, e.g. "sticks" or "fibres".
+    item_names : set of str
+        The inventory item names.
+
+    Returns:
+    --------
+    str
+        The matching item name, or the lowercased word if none matches.
+    """
+    word = word.lower()
+    word = ITEM_ALIASES.get(word, word)
+    candidates = (
+        word,
+        word[:-1] if word.endswith("s") else None,
+        word[:-2] if word.endswith("es") else None,
+        word[:-3] + "y" if word.endswith("ies") else None,
+    )
+    for candidate in candidates:
+        if candidate and candidate in item_names:
+            return candidate
+    return word
+
+
+def is_critical(level):
+    """
+    Tells whether a player stat level is Critical.
+    """
+    return isinstance(level, str) and level.strip().lower() == CRITICAL_LEVEL
@@ -1,7 +1,10 @@
 import json
+import threading
+from contextvars import ContextVar
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 from langchain.agents import tool, create_tool_calling_agent, AgentExecutor
+from langchain_core.callbacks import BaseCallbackHandler
 import logging
 from app import config
 from dotenv import load_dotenv
@@ -11,6 +14,9 @@ import os
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# JSON of the books of the session the agent is currently deciding for, set around each execution
+current_books = ContextVar("current_books", default=None)
+
 @tool
 def read_book(book_name: str) -> str:
     """
@@ -23,6 +29,13 @@ def read_book(book_name: str) -> str:
         str: Book content in JSON format.
     """
     try:
+        books = current_books.get()
+        if books is not None:
+            # Serve the snapshot taken with the prompt, the live session may be changed by another turn
+            if book_name not in books:
+                raise ValueError(f"Record {book_name} not found.")
+            return books[book_name]
+
         file_path = f"app/settings/{book_name}.json"
         with open(file_path, "r") as file:
             content = json.load(file)
@@ -31,18 +44,83 @@ def read_book(book_name: str) -> str:
         logger.error(f"Error reading book '{book_name}': {e}")
         return json.dumps({"error": str(e)})
 
-class SurvivalGameAgent:
+SNAPSHOT_SYSTEM_PROMPT = '''
+                    You are a character in a video game on a tropical island. Your goal is to survive by maintaining hunger, thirst, stress, and health levels and escape the island.
+
+                    Here is an up-to-date snapshot of all the books (instructions, actions, logs, game_info, player_info, inventory, objectives):
+
+                    {books}
+
+                    Decide your next move from this snapshot. Only use the read_book tool if you need the raw JSON content of a book.
+                    Return a JSON object with "action" (the next action to take) and "observation" (a short, informative explanation for that action). The action can only be one of the actions in the actions book.
+                '''
+
+class RoundTripCounter(BaseCallbackHandler):
+    """
+    Counts the LLM calls made while the agent takes one decision.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.count += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.count += 1
+
+class RoundTripStats:
+    """
+    Aggregated number of LLM round trips per agent decision.
+    """
     def __init__(self):
+        self._lock = threading.Lock()
+        self.decisions = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, round_trips):
+        """
+        Record the round trips of one decision.
+
+        Parameters:
+            round_trips (int): Number of LLM calls made for the decision.
+        """
+        with self._lock:
+            self.decisions += 1
+            self.total += round_trips
+            self.max = max(self.max, round_trips)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Number of decisions, total, mean and max round trips, and the configured bound.
+        """
+        with self._lock:
+            return {
+                "decisions": self.decisions,
+                "total": self.total,
+                "mean": self.total / self.decisions if self.decisions else 0.0,
+                "max": self.max,
+                "bound": config.AGENT_MAX_ITERATIONS,
+            }
+
+round_trip_stats = RoundTripStats()
+
+class SurvivalGameAgent:
+    def __init__(self, context_mode=None):
         """
         Initialize the SurvivalGameAgent with OpenAI API key and necessary configurations.
 
         Parameters:
-            openai_api_key (str): API key for OpenAI.
+            context_mode (str, optional): "tools" to let the agent discover the books through read_book calls,
+                "snapshot" to pre-seed the prompt with all the books. Defaults to config.AGENT_CONTEXT_MODE.
         """
+        self.context_mode = context_mode or config.AGENT_CONTEXT_MODE
         self.tools = [read_book]
-        self.prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", '''
+        if self.context_mode == "snapshot":
+            system_prompt = SNAPSHOT_SYSTEM_PROMPT
+        else:
+            system_prompt = '''
                     You are a character in a video game on a tropical island. Your goal is to survive by maintaining hunger, thirst, stress, and health levels and escape the island.
 
                     You have access to books that contain information about:
@@ -56,7 +134,10 @@ class SurvivalGameAgent:
 
                     Explore all available books to gather information before deciding your next move. 
                     Return a JSON object with "action" (the next action to take) and "observation" (a short, informative explanation for that action). The action can only be one of the actions in the actions book.
-                '''),
+                '''
+        self.prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", system_prompt),
                 ("human", "{input}"),
                 MessagesPlaceholder(variable_name="agent_scratchpad"),
             ]
@@ -65,7 +146,12 @@ class SurvivalGameAgent:
         load_dotenv()
 
         self.api_key = os.getenv('OPENAI_API_KEY')
-        self.llm = ChatOpenAI(model=config.GPT_ENGINE, api_key=self.api_key)
+        # Let the model request several books in one turn, the executor runs them concurrently
+        self.llm = ChatOpenAI(
+            model=config.GPT_ENGINE,
+            api_key=self.api_key,
+            model_kwargs={"parallel_tool_calls": config.AGENT_PARALLEL_TOOL_CALLS},
+        )
         self.agent = None
         self.agent_executor = None
 
@@ -76,44 +162,120 @@ class SurvivalGameAgent:
         try:
             self.agent = create_tool_calling_agent(self.llm, self.tools, self.prompt)
             self.agent_executor = AgentExecutor(
-                agent=self.agent, tools=self.tools, verbose=True, handle_parsing_errors=True
+                agent=self.agent, tools=self.tools, verbose=True, handle_parsing_errors=True,
+                max_iterations=config.AGENT_MAX_ITERATIONS,
             )
             logger.info("Agent initialized successfully.")
         except Exception as e:
             logger.error(f"Error initializing agent: {e}")
 
-    def execute_agent(self, input_data):
+    def _prepare_input(self, input_data, books):
+        """
+        Complete the input data of an execution with the tools and, in snapshot mode, the books.
+        """
+        input_data["tools"] = self.tools  # Add tools to input data
+        input_data["tool_names"] = [tool.name for tool in self.tools]  # Add tool names to input data
+        if self.context_mode == "snapshot" and "books" not in input_data:
+            input_data["books"] = "\n\n".join(f"{name}: {content}" for name, content in (books or {}).items())
+        return input_data
+
+    def execute_agent(self, input_data, books=None):
         """
         Execute the agent with given input data.
 
         Parameters:
             input_data (dict): Data to be processed by the agent.
+            books (dict, optional): JSON of each book of the session, keyed by book name, as returned by
+                SettingsManager.records_json. The books are read from app/settings when omitted.
 
         Returns:
             tuple: The next action and observation.
         """
+        token = current_books.set(books)
+        counter = RoundTripCounter()
         try:
-            input_data["tools"] = self.tools  # Add tools to input data
-            input_data["tool_names"] = [tool.name for tool in self.tools]  # Add tool names to input data
-            output = self.agent_executor.invoke(input_data)
+            output = self.agent_executor.invoke(self._prepare_input(input_data, books), config={"callbacks": [counter]})
 
             #logger.info(f"Output: {output}")
 
-            # Clean up the output to remove the backticks and parse the JSON
-            if 'output' in output:
-                cleaned_output = output['output'].strip('```json\n').strip('\n```')
-                try:
-                    parsed_output = json.loads(cleaned_output)
-                    action = parsed_output.get("action")
-                    observation = parsed_output.get("observation")
-                    return action, observation
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse JSON: {e}")
-                    logger.error(f"Output content: {cleaned_output}")
-                    return None, None
-            else:
-                logger.error("Key 'output' not found in the output dictionary.")
-                return None, None
+            return self._parse_output(output)
+        except Exception as e:
+            logger.error(f"Error executing agent: {e}")
+            return None, None
+        finally:
+            current_books.reset(token)
+            round_trip_stats.record(counter.count)
+            logger.info(f"Agent decision took {counter.count} LLM round trip(s)")
+
+    async def aexecute_agent(self, input_data, books=None):
+        """
+        Execute the agent with given input data without blocking the event loop.
+
+        Parameters:
+            input_data (dict): Data to be processed by the agent.
+            books (dict, optional): JSON of each book of the session, keyed by book name, as returned by
+                SettingsManager.records_json. The books are read from app/settings when omitted.
+
+        Returns:
+            tuple: The next action and observation.
+        """
+        token = current_books.set(books)
+        counter = RoundTripCounter()
+        try:
+            output = await self.agent_executor.ainvoke(self._prepare_input(input_data, books), config={"callbacks": [counter]})
+            return self._parse_output(output)
         except Exception as e:
             logger.error(f"Error executing agent: {e}")
             return None, None
+        finally:
+            current_books.reset(token)
+            round_trip_stats.record(counter.count)
+            logger.info(f"Agent decision took {counter.count} LLM round trip(s)")
+
+    def _parse_output(self, output):
+        """
+        Parse the action and observation out of the agent executor output.
+
+        Parameters:
+            output (dict): Output of the agent executor.
+
+        Returns:
+            tuple: The next action and observation, or (None, None) if the output cannot be parsed.
+        """
+        # Clean up the output to remove the backticks and parse the JSON
+        if 'output' in output:
+            cleaned_output = output['output'].strip('```json\n').strip('\n```')
+            try:
+                parsed_output = json.loads(cleaned_output)
+                action = parsed_output.get("action")
+                observation = parsed_output.get("observation")
+                return action, observation
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to parse JSON: {e}")
+                logger.error(f"Output content: {cleaned_output}")
+                return None, None
+        else:
+            logger.error("Key 'output' not found in the output dictionary.")
+            return None, None
+
+
+_agent = None
+_agent_lock = threading.Lock()
+
+def get_agent():
+    """
+    Return the process-wide SurvivalGameAgent, building the LLM client, prompt and executor on first use.
+
+    The executor keeps no state between invocations, so it is shared by every request.
+
+    Returns:
+        SurvivalGameAgent: The initialized agent.
+    """
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                agent = SurvivalGameAgent()
+                agent.initialize_agent()
+                _agent = agent
+    return _agent
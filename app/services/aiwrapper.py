@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
 import os
-from dotenv import load_dotenv
 import logging
+from types import SimpleNamespace
+from services.client_pool import load_environment, get_client, get_async_client
 
 class AIWrapper(ABC):
     """
@@ -27,7 +28,7 @@ class AIWrapper(ABC):
         env_var_name : str
             The name of the environment variable that contains the API key.
         """
-        load_dotenv()  # Load environment variables from a .env file.
+        load_environment()  # Load environment variables from a .env file, once per process.
         self.api_key = os.getenv(env_var_name)  # Retrieve the API key from the environment variable.
         self.model = model  # Set the AI model name.
         self.messages = []  # Initialize an empty list for storing messages.
@@ -89,6 +90,13 @@ class AIWrapper(ABC):
         """
         return self.messages
 
+    def warm_up(self):
+        """
+        Prepares what the first completion needs, e.g. the async client, so it is not paid by the first request.
+        Does nothing by default.
+        """
+        pass
+
     def completion(self, response_format="text", **kwargs):
         """
         Requests a completion from the AI model.
@@ -105,6 +113,61 @@ class AIWrapper(ABC):
         object
             The completion response from the AI model.
         """
+        return self._create_completion(self._build_params(response_format, **kwargs))  # Call the method to create the completion.
+
+    async def acompletion(self, response_format="text", **kwargs):
+        """
+        Requests a completion from the AI model without blocking the event loop.
+
+        Parameters:
+        -----------
+        response_format : str, optional
+            The format of the response ("text" or "json"). Default is "text".
+        **kwargs
+            Additional parameters to pass to the completion request.
+
+        Returns:
+        --------
+        object
+            The completion response from the AI model.
+        """
+        return await self._acreate_completion(self._build_params(response_format, **kwargs))
+
+    def astream_completion(self, response_format="text", **kwargs):
+        """
+        Requests a streamed completion from the AI model.
+
+        Parameters:
+        -----------
+        response_format : str, optional
+            The format of the response ("text" or "json"). Default is "text".
+        **kwargs
+            Additional parameters to pass to the completion request.
+
+        Returns:
+        --------
+        AsyncIterator
+            The completion chunks, as they are received. The token usage is reported on the last chunk
+            when the provider supports it.
+        """
+        return self._astream_completion(self._build_params(response_format, stream=True, **kwargs))
+
+    def _build_params(self, response_format="text", **kwargs):
+        """
+        Builds the parameters of a completion request.
+
+        Parameters:
+        -----------
+        response_format : str, optional
+            The format of the response ("text" or "json"). Default is "text".
+        **kwargs
+            Additional parameters to pass to the completion request.
+
+        Returns:
+        --------
+        dict
+            The parameters for the completion request.
+        """
         api_params = {
             "model": self.model,  # Include the model name in the request parameters.
             "messages": self.messages,  # Include the messages in the request parameters.
@@ -117,7 +180,7 @@ class AIWrapper(ABC):
         if response_format == "json":
             api_params["response_format"] = {"type": "json_object"}  # Set the response format to JSON if specified.
 
-        return self._create_completion(api_params)  # Call the method to create the completion.
+        return api_params
 
     @abstractmethod
     def _create_completion(self, api_params):
@@ -136,6 +199,45 @@ class AIWrapper(ABC):
         """
         pass
 
+    @abstractmethod
+    async def _acreate_completion(self, api_params):
+        """
+        Abstract method to create a completion asynchronously. Must be implemented by subclasses.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request.
+
+        Returns:
+        --------
+        object
+            The completion response from the AI model.
+        """
+        pass
+
+    async def _astream_completion(self, api_params):
+        """
+        Creates a streamed completion. By default the completion is requested in one piece and sent
+        as a single chunk, subclasses whose provider supports streaming override it.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request, with stream set.
+
+        Returns:
+        --------
+        AsyncIterator
+            The completion chunks, shaped like the OpenAI chat completion chunks with the usage on the last one.
+        """
+        params = {key: value for key, value in api_params.items() if key != "stream"}
+        response = await self._acreate_completion(params)
+        message = response.choices[0].message
+        delta = SimpleNamespace(role=message.role, content=message.content)
+        yield SimpleNamespace(model=response.model, choices=[SimpleNamespace(index=0, delta=delta)],
+                              usage=getattr(response, "usage", None))
+
 class OpenAIWrapper(AIWrapper):
     """
     Wrapper class for the OpenAI API.
@@ -153,16 +255,19 @@ class OpenAIWrapper(AIWrapper):
 
     def _initialize_client(self):
         """
-        Initializes the OpenAI client.
+        Initializes the OpenAI client, shared with every other wrapper of the same model.
         """
-        import openai  # Import the OpenAI library.
-        openai.api_key = self.api_key  # Set the API key for the OpenAI client.
         try:
-            self.client = openai.OpenAI(api_key=self.api_key)  # Initialize the OpenAI client.
-            logging.info("OpenAI client initialized successfully")  # Log successful initialization.
+            self.client = get_client("openai", self.model, self.api_key)  # Get the pooled OpenAI client.
         except Exception as e:
             logging.error(f"Error initializing OpenAI client: {e}")  # Log any errors during initialization.
 
+    def warm_up(self):
+        """
+        Creates the pooled async OpenAI client used by acompletion and astream_completion.
+        """
+        get_async_client("openai", self.model, self.api_key)
+
     def _create_completion(self, api_params):
         """
         Creates a completion using the OpenAI API.
@@ -179,6 +284,42 @@ class OpenAIWrapper(AIWrapper):
         """
         return self.client.chat.completions.create(**api_params)
 
+    async def _acreate_completion(self, api_params):
+        """
+        Creates a completion using the async OpenAI client.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request.
+
+        Returns:
+        --------
+        object
+            The completion response from the OpenAI API.
+        """
+        client = get_async_client("openai", self.model, self.api_key)
+        return await client.chat.completions.create(**api_params)
+
+    async def _astream_completion(self, api_params):
+        """
+        Creates a streamed completion using the async OpenAI client, with the usage reported on the last chunk.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request, with stream set.
+
+        Returns:
+        --------
+        AsyncIterator
+            The completion chunks from the OpenAI API.
+        """
+        client = get_async_client("openai", self.model, self.api_key)
+        stream = await client.chat.completions.create(**api_params, stream_options={"include_usage": True})
+        async for chunk in stream:
+            yield chunk
+
 class GroqWrapper(AIWrapper):
     """
     Wrapper class for the Groq API.
@@ -196,15 +337,19 @@ class GroqWrapper(AIWrapper):
 
     def _initialize_client(self):
         """
-        Initializes the Groq client.
+        Initializes the Groq client, shared with every other wrapper of the same model.
         """
-        from groq import Groq  # Import the Groq library.
         try:
-            self.client = Groq(api_key=self.api_key)  # Initialize the Groq client.
-            logging.info("Groq client initialized successfully")  # Log successful initialization.
+            self.client = get_client("groq", self.model, self.api_key)  # Get the pooled Groq client.
         except Exception as e:
             logging.error(f"Error initializing Groq client: {e}")  # Log any errors during initialization.
 
+    def warm_up(self):
+        """
+        Creates the pooled async Groq client used by acompletion and astream_completion.
+        """
+        get_async_client("groq", self.model, self.api_key)
+
     def _create_completion(self, api_params):
         """
         Creates a completion using the Groq API.
@@ -220,3 +365,47 @@ class GroqWrapper(AIWrapper):
             The completion response from the Groq API.
         """
         return self.client.chat.completions.create(**api_params)
+
+    async def _acreate_completion(self, api_params):
+        """
+        Creates a completion using the async Groq client.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request.
+
+        Returns:
+        --------
+        object
+            The completion response from the Groq API.
+        """
+        client = get_async_client("groq", self.model, self.api_key)
+        return await client.chat.completions.create(**api_params)
+
+    async def _astream_completion(self, api_params):
+        """
+        Creates a streamed completion using the async Groq client. Groq reports the usage in x_groq on the last chunk.
+
+        Groq rejects JSON mode on streamed requests, so a JSON completion is requested in one
+        piece and sent as a single chunk instead.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request, with stream set.
+
+        Returns:
+        --------
+        AsyncIterator
+            The completion chunks from the Groq API.
+        """
+        if "response_format" in api_params:
+            async for chunk in super()._astream_completion(api_params):
+                yield chunk
+            return
+        client = get_async_client("groq", self.model, self.api_key)
+        stream = await client.chat.completions.create(**api_params)
+        async for chunk in stream:
+            yield chunk
+
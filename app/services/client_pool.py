@@ -0,0 +1,161 @@
+import threading
+import logging
+from app import config
+from dotenv import load_dotenv
+
+# Registry of the LLM clients shared by every wrapper, keyed by (provider, model, is_async)
+_clients = {}
+_clients_lock = threading.Lock()
+_environment_loaded = False
+
+
+def load_environment():
+    """
+    Loads the environment variables from the .env file, only the first time it is called.
+    """
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+
+def _http_client(is_async=False):
+    """
+    Creates the HTTP client used by an LLM client, with keep-alive connection pooling.
+
+    Parameters:
+    -----------
+    is_async : bool, optional
+        Whether to create an httpx.AsyncClient instead of an httpx.Client. Default is False.
+
+    Returns:
+    --------
+    httpx.Client or httpx.AsyncClient
+        An HTTP client configured with the pool limits and timeouts from the configuration.
+    """
+    import httpx
+
+    client_class = httpx.AsyncClient if is_async else httpx.Client
+    return client_class(
+        limits=httpx.Limits(
+            max_connections=config.LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=config.LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=config.LLM_POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(config.LLM_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT),
+    )
+
+
+def _build_client(provider, api_key, is_async=False):
+    """
+    Creates the client for a provider.
+
+    Parameters:
+    -----------
+    provider : str
+        The provider of the model ("openai" or "groq").
+    api_key : str
+        The API key for authenticating with the provider.
+    is_async : bool, optional
+        Whether to create the async flavour of the client. Default is False.
+
+    Returns:
+    --------
+    object
+        The provider client.
+    """
+    if provider == "openai":
+        import openai  # Import the OpenAI library.
+        client_class = openai.AsyncOpenAI if is_async else openai.OpenAI
+        return client_class(api_key=api_key, http_client=_http_client(is_async))
+    if provider == "groq":
+        from groq import Groq, AsyncGroq  # Import the Groq library.
+        client_class = AsyncGroq if is_async else Groq
+        return client_class(api_key=api_key, http_client=_http_client(is_async))
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def _get_or_build(provider, model, api_key, is_async):
+    key = (provider, model, is_async)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _build_client(provider, api_key, is_async)
+                _clients[key] = client
+                kind = "async " if is_async else ""
+                logging.info(f"{provider} {kind}client for {model} initialized successfully")
+    return client
+
+
+def get_client(provider, model, api_key):
+    """
+    Returns the shared client for a provider and model, creating it on first use.
+
+    Parameters:
+    -----------
+    provider : str
+        The provider of the model ("openai" or "groq").
+    model : str
+        The name or identifier of the model.
+    api_key : str
+        The API key for authenticating with the provider.
+
+    Returns:
+    --------
+    object
+        The provider client.
+    """
+    return _get_or_build(provider, model, api_key, is_async=False)
+
+
+def get_async_client(provider, model, api_key):
+    """
+    Returns the shared async client for a provider and model, creating it on first use.
+
+    Parameters:
+    -----------
+    provider : str
+        The provider of the model ("openai" or "groq").
+    model : str
+        The name or identifier of the model.
+    api_key : str
+        The API key for authenticating with the provider.
+
+    Returns:
+    --------
+    object
+        The async provider client.
+    """
+    return _get_or_build(provider, model, api_key, is_async=True)
+
+
+def close_clients():
+    """
+    Closes every shared sync client and its connection pool.
+    """
+    with _clients_lock:
+        for (provider, model, is_async), client in list(_clients.items()):
+            if is_async:
+                continue
+            try:
+                client.close()
+            except Exception as e:
+                logging.error(f"Error closing {provider} client for {model}: {e}")
+            del _clients[(provider, model, is_async)]
+
+
+async def aclose_clients():
+    """
+    Closes every shared client, sync and async, and its connection pool.
+    """
+    close_clients()
+    with _clients_lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for (provider, model, _), client in clients:
+        try:
+            await client.close()
+        except Exception as e:
+            logging.error(f"Error closing {provider} async client for {model}: {e}")
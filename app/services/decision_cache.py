@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from app import config
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of validated decisions, keyed on a fingerprint of the game state.
+
+    Entries expire after a time to live, so a stale decision is never served for long.
+    The counters are exposed through stats().
+    """
+
+    def __init__(self, max_size, ttl):
+        """
+        Initializes a new DecisionCache.
+
+        Parameters:
+        -----------
+        max_size : int
+            Maximum number of decisions kept; the least recently used one is evicted first.
+        ttl : float
+            Seconds a decision stays valid after it was stored.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, decision)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def should_bypass(self):
+        """
+        Tells whether the cache must be skipped because the sampling temperature makes decisions non repeatable.
+
+        Returns:
+        --------
+        bool
+            True if config.LLM_TEMPERATURE is above config.DECISION_CACHE_MAX_TEMPERATURE.
+        """
+        return config.LLM_TEMPERATURE > config.DECISION_CACHE_MAX_TEMPERATURE
+
+    def get(self, key):
+        """
+        Returns the decision stored for a state, if any.
+
+        Parameters:
+        -----------
+        key : str
+            The state fingerprint.
+
+        Returns:
+        --------
+        str or None
+            The decision as a JSON string, or None on a miss or when the cache is bypassed.
+        """
+        with self._lock:
+            if self.should_bypass():
+                self.bypasses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, decision):
+        """
+        Stores the decision taken for a state.
+
+        Parameters:
+        -----------
+        key : str
+            The state fingerprint.
+        decision : str
+            The decision as a JSON string.
+        """
+        if self.should_bypass():
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, decision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes every stored decision.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        --------
+        dict
+            The number of entries, hits, misses and bypasses, and the hit ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_decision_cache():
+    """
+    Returns the process-wide DecisionCache, creating it on first use.
+
+    Returns:
+    --------
+    DecisionCache
+        The shared decision cache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DecisionCache(config.DECISION_CACHE_SIZE, config.DECISION_CACHE_TTL)
+    return _cache
@@ -1,43 +1,50 @@
 from app import config  # Configuration settings
 from pydantic import ValidationError
 import logging
+import re
+import json
+import time
 from validation.pydantic_val import NextAction
+from app.services.dispatcher import get_dispatcher
+from app.services.rate_limiter import PRIORITY_CRITICAL, PRIORITY_NORMAL
 
 # Initialize the logger
 logger = logging.getLogger(__name__)
 
+# The complete "action" string of a JSON object, found in the partial completion while it streams
+ACTION_PATTERN = re.compile(r'"action"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
 
 
 class Decision:
     """
-    Represents the decision-making process for the game character using OpenAI's model.
+    Represents the decision-making process for the game character using the configured LLM engines.
     """
 
-    def __init__(self, memory):
+    def __init__(self, memory, prompt_tokens=0, critical=False):
         """
         Initializes a new Decision instance.
 
         Parameters:
         -----------
-        memory : Memory
-            An instance of the Memory class.
+        memory : str or list of dict
+            The memory as a single system prompt, or as chat messages in the format {"role": role, "content": content}.
+        prompt_tokens : int, optional
+            The number of tokens of the memory, counted against the token quota of the rate limiter.
+        critical : bool, optional
+            Whether the player is in a critical state, so the call is served ahead of the others when rate limited.
         """
         self.memory = memory
+        self.prompt_tokens = prompt_tokens
+        self.priority = PRIORITY_CRITICAL if critical else PRIORITY_NORMAL
+        self.usage = {}
+        self.ttft = None
+        self.engine = None  # the engine that answered, set once a completion is received
+        self.dispatcher = get_dispatcher()
 
-        if config.LLM_ENGINE == "openai":
-            from services.aiwrapper import OpenAIWrapper
-            self.decision_wrapper = OpenAIWrapper(config.GPT_ENGINE)
-            logging.info("OpenAI model initialized successfully")
-        
-        # else if it's one of these: "llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768", "gemma-7b-it"
-        elif config.LLM_ENGINE in ["llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768", "gemma-7b-it"]:
-            from services.aiwrapper import GroqWrapper
-            self.decision_wrapper = GroqWrapper(config.LLM_ENGINE)
-            logging.info("Groq model initialized successfully")
-
-    def get_next_action(self):
+    async def aget_next_action(self):
         """
-        Gets the next action from the language model based on the current memory.
+        Gets the next action from the language model based on the current memory, without blocking the event loop.
 
         Returns:
         --------
@@ -45,20 +52,12 @@ class Decision:
             The next action as a JSON string.
         """
 
-        # Add the memory string as a system message
-        self.decision_wrapper.add_message("system", self.memory)
-
         try:
             # Get the next action from the model
-            response = self.decision_wrapper.completion(response_format="json")
-            # Extract the content from the response
-            response_content = response.choices[0].message.content
-
-            # Validate the response content with Pydantic
-            action_response = NextAction.model_validate_json(response_content)
-
-            # Return the validated JSON response
-            return action_response.model_dump_json()
+            self.engine, response = await self.dispatcher.acompletion(
+                self._memory_messages(), response_format="json", prompt_tokens=self.prompt_tokens,
+                priority=self.priority, temperature=config.LLM_TEMPERATURE)
+            return self._parse_response(response)
 
         except ValidationError as e:
             # Handle validation errors
@@ -69,5 +68,134 @@ class Decision:
             # Log the error
             logger.error(f"Error fetching next action: {e}")
             return '{"action": "", "observation": "Error fetching next action"}'
-        
-        
+
+    async def astream_next_action(self):
+        """
+        Streams the next action from the language model, so the action can be used before the observation is complete.
+
+        The time to the first streamed token is stored in self.ttft, in seconds.
+
+        Yields:
+        -------
+        tuple of (str, str)
+            ("action", action) as soon as the action string of the completion is complete, then
+            ("done", next_action) with the full validated next action as a JSON string. If the
+            completion fails, only ("done", error) is sent, with the same errors as aget_next_action.
+        """
+
+        try:
+            start = time.perf_counter()
+            content = ""
+            action = None
+            stream = self.dispatcher.astream_completion(
+                self._memory_messages(), response_format="json", prompt_tokens=self.prompt_tokens,
+                priority=self.priority, temperature=config.LLM_TEMPERATURE)
+            async for self.engine, chunk in stream:
+                usage = self._stream_usage(chunk)
+                if usage is not None:
+                    self.usage = self._usage_counts(usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - start
+                content += delta
+                if action is None:
+                    match = ACTION_PATTERN.search(content)
+                    if match:
+                        action = json.loads(f'"{match.group(1)}"')
+                        yield "action", action
+
+            # Validate the response content with Pydantic
+            yield "done", NextAction.model_validate_json(content).model_dump_json()
+
+        except ValidationError as e:
+            # Handle validation errors
+            logger.error(f"Validation error: {e.json()}")
+            yield "done", '{"action": "", "observation": "Validation error"}'
+
+        except Exception as e:
+            # Log the error
+            logger.error(f"Error fetching next action: {e}")
+            yield "done", '{"action": "", "observation": "Error fetching next action"}'
+
+    def _stream_usage(self, chunk):
+        """
+        Returns the token usage carried by a streamed chunk: in usage for OpenAI, in x_groq.usage for Groq.
+        """
+        usage = getattr(chunk, "usage", None)
+        if usage is None:
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        return usage
+
+    def _memory_messages(self):
+        """
+        Returns the memory as chat messages in the format {"role": role, "content": content}.
+        """
+        if isinstance(self.memory, str):
+            # Send the memory string as a system message
+            return [{"role": "system", "content": self.memory}]
+        return list(self.memory)
+
+    def _read_usage(self, response):
+        """
+        Reads the token usage of a completion response, including the prompt tokens served from the provider cache.
+
+        Parameters:
+        -----------
+        response : object
+            The completion response from the AI model.
+
+        Returns:
+        --------
+        dict
+            The prompt, completion and cached token counts. Missing values are reported as 0.
+        """
+        return self._usage_counts(getattr(response, "usage", None))
+
+    def _usage_counts(self, usage):
+        """
+        Reads the prompt, completion and cached token counts of a usage object. Missing values are reported as 0.
+        """
+        details = getattr(usage, "prompt_tokens_details", None)
+        if isinstance(details, dict):
+            cached_tokens = details.get("cached_tokens")
+        else:
+            cached_tokens = getattr(details, "cached_tokens", None)
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+            "cached_tokens": cached_tokens or 0,
+        }
+
+    def _parse_response(self, response):
+        """
+        Extracts and validates the next action from a completion response.
+
+        Parameters:
+        -----------
+        response : object
+            The completion response from the AI model.
+
+        Returns:
+        --------
+        str
+            The validated next action as a JSON string.
+
+        Raises:
+        -------
+        ValidationError
+            If the response content is not a valid NextAction.
+        """
+        self.usage = self._read_usage(response)
+
+        # Extract the content from the response
+        response_content = response.choices[0].message.content
+
+        # Validate the response content with Pydantic
+        action_response = NextAction.model_validate_json(response_content)
+
+        # Return the validated JSON response
+        return action_response.model_dump_json()
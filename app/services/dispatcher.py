@@ -0,0 +1,464 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from app import config
+from app.services import metrics
+from app.services.rate_limiter import PRIORITY_NORMAL, get_rate_limiter
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+GROQ_ENGINES = ["llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768", "gemma-7b-it"]
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = (408, 409, 429)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when every engine is skipped because its circuit breaker is open.
+    """
+
+
+def create_wrapper(engine):
+    """
+    Creates the AIWrapper of an engine.
+
+    Parameters:
+    -----------
+    engine : str
+        "openai" (the model is config.GPT_ENGINE), "mock" or one of the Groq models.
+
+    Returns:
+    --------
+    AIWrapper
+        The wrapper of the engine.
+    """
+    if engine == "openai":
+        from services.aiwrapper import OpenAIWrapper
+        return OpenAIWrapper(config.GPT_ENGINE)
+
+    # else if it's one of these: "llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768", "gemma-7b-it"
+    if engine in GROQ_ENGINES:
+        from services.aiwrapper import GroqWrapper
+        return GroqWrapper(engine)
+
+    if engine == "mock":
+        from simulator.mock_llm import MockWrapper
+        return MockWrapper(engine)
+
+    raise ValueError(f"Unknown LLM engine: {engine}")
+
+
+def engine_model(engine):
+    """
+    Returns the model an engine sends its calls to, e.g. config.GPT_ENGINE for "openai".
+    """
+    return config.GPT_ENGINE if engine == "openai" else engine
+
+
+def is_retryable(error):
+    """
+    Tells whether a failed LLM call may succeed if it is sent again.
+
+    Parameters:
+    -----------
+    error : BaseException
+        The error raised by the call.
+
+    Returns:
+    --------
+    bool
+        True for timeouts, connection errors, rate limits and server errors.
+    """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    # The OpenAI and Groq SDKs raise APIConnectionError and APITimeoutError without a status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class CircuitBreaker:
+    """
+    Stops sending calls to an engine after consecutive failures.
+
+    After failure_threshold consecutive failures the circuit opens and the engine is skipped.
+    Once reset_timeout seconds have passed, a single trial call is let through (half open):
+    its success closes the circuit, its failure opens it again. A call allowed by allow() must
+    end with record_success, record_failure or release, so the trial is never left reserved.
+    """
+
+    def __init__(self, engine, failure_threshold, reset_timeout):
+        """
+        Initializes a new CircuitBreaker.
+
+        Parameters:
+        -----------
+        engine : str
+            The engine guarded by the breaker.
+        failure_threshold : int
+            Consecutive failures that open the circuit.
+        reset_timeout : float
+            Seconds the circuit stays open before a trial call.
+        """
+        self.engine = engine
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        Returns "closed", "open" or "half_open".
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        """
+        Tells whether a call can be sent to the engine, reserving the trial call when half open.
+
+        Returns:
+        --------
+        bool
+            False while the circuit is open or the trial call is in flight.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def release(self):
+        """
+        Frees the trial call reserved by allow() when the call was dropped without an outcome,
+        e.g. cancelled or shed by the rate limiter.
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        """
+        Closes the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Counts a failure, opening the circuit at the threshold or when the trial call failed.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial:
+                    logger.warning(f"Circuit opened for engine {self.engine} after {self.failures} failure(s)")
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class LatencyTracker:
+    """
+    Latencies of the last successful calls of an engine.
+    """
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q, min_samples=1):
+        """
+        Returns the q quantile of the recorded latencies, or None with fewer than min_samples samples.
+        """
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Dispatcher:
+    """
+    Sends completion requests to the configured engines.
+
+    Each call is retried with jittered exponential backoff when the error is transient. When
+    an engine keeps failing its circuit breaker skips it and the next engine of
+    config.LLM_FALLBACK_ENGINES is used. With config.LLM_HEDGE_ENABLED, a second engine is
+    called when the first one has not answered within its p95 latency (config.LLM_HEDGE_QUANTILE),
+    and the first answer is used.
+    """
+
+    def __init__(self, engines=None):
+        """
+        Initializes a new Dispatcher.
+
+        Parameters:
+        -----------
+        engines : list of str, optional
+            The engines in order of preference. Defaults to config.LLM_ENGINE followed by config.LLM_FALLBACK_ENGINES.
+        """
+        self.engines = engines or [config.LLM_ENGINE] + [
+            engine for engine in config.LLM_FALLBACK_ENGINES if engine != config.LLM_ENGINE
+        ]
+        self.breakers = {
+            engine: CircuitBreaker(engine, config.CIRCUIT_FAILURE_THRESHOLD, config.CIRCUIT_RESET_TIMEOUT)
+            for engine in self.engines
+        }
+        self.latencies = {engine: LatencyTracker() for engine in self.engines}
+        logger.info(f"LLM engines initialized: {', '.join(self.engines)}")
+
+    @contextmanager
+    def _attempt(self, engine):
+        """
+        Reserves a call to an engine from its circuit breaker and records the outcome of the call.
+
+        The block sets call["start"] right before sending the request. An error raised before
+        that, e.g. RateLimitShed, or a cancellation, releases the reservation without counting
+        as a failure of the engine.
+
+        Raises:
+        -------
+        CircuitOpenError
+            If the circuit of the engine is open or its trial call is in flight.
+        """
+        breaker = self.breakers[engine]
+        if not breaker.allow():
+            metrics.LLM_DISPATCH.inc(engine=engine, result="circuit_open")
+            raise CircuitOpenError(f"The circuit is open for engine {engine}")
+        call = {"start": None}
+        try:
+            yield call
+        except Exception as e:
+            if call["start"] is None:
+                breaker.release()
+            else:
+                self._record(engine, call["start"], e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            self._record(engine, call["start"])
+
+    def _failed(self, errors):
+        """
+        Returns the error to raise once every engine failed: the last one, or a CircuitOpenError
+        naming every engine when they were all skipped.
+        """
+        if all(isinstance(error, CircuitOpenError) for error in errors):
+            return CircuitOpenError(f"The circuit is open for every engine: {', '.join(self.engines)}")
+        return errors[-1]
+
+    def _retry_options(self):
+        return {
+            "stop": stop_after_attempt(config.LLM_RETRY_ATTEMPTS),
+            "wait": wait_random_exponential(multiplier=config.LLM_RETRY_BASE_WAIT, max=config.LLM_RETRY_MAX_WAIT),
+            "retry": retry_if_exception(is_retryable),
+            "reraise": True,
+        }
+
+    def _wrapper(self, engine, messages):
+        wrapper = create_wrapper(engine)
+        for message in messages:
+            wrapper.add_message(message["role"], message["content"])
+        return wrapper
+
+    def _record(self, engine, start, error=None):
+        if error is None:
+            self.breakers[engine].record_success()
+            self.latencies[engine].record(time.perf_counter() - start)
+            metrics.LLM_DISPATCH.inc(engine=engine, result="success")
+        else:
+            self.breakers[engine].record_failure()
+            metrics.LLM_DISPATCH.inc(engine=engine, result="failure")
+
+    def hedge_delay(self, engine):
+        """
+        Returns how long to wait for an engine before hedging, in seconds.
+
+        Parameters:
+        -----------
+        engine : str
+            The engine called first.
+
+        Returns:
+        --------
+        float
+            The config.LLM_HEDGE_QUANTILE latency of the engine, or config.LLM_HEDGE_DEFAULT_DELAY
+            until config.LLM_HEDGE_MIN_SAMPLES calls have been measured.
+        """
+        delay = self.latencies[engine].quantile(config.LLM_HEDGE_QUANTILE, config.LLM_HEDGE_MIN_SAMPLES)
+        return config.LLM_HEDGE_DEFAULT_DELAY if delay is None else delay
+
+    async def _acall(self, engine, messages, response_format, kwargs, prompt_tokens=0, priority=PRIORITY_NORMAL):
+        """
+        Requests a completion from one engine, with retries. Every attempt waits for the rate limiter of the engine model.
+        """
+        limiter = get_rate_limiter(engine_model(engine))
+        async for attempt in AsyncRetrying(**self._retry_options()):
+            with attempt, self._attempt(engine) as call:
+                await limiter.acquire(prompt_tokens, priority)
+                call["start"] = time.perf_counter()
+                return await self._wrapper(engine, messages).acompletion(response_format, **kwargs)
+
+    async def _afailover(self, engines, messages, response_format, kwargs, prompt_tokens, priority, errors=()):
+        """
+        Tries the engines one after the other until one answers.
+        """
+        errors = list(errors)
+        for engine in engines:
+            try:
+                return engine, await self._acall(engine, messages, response_format, kwargs, prompt_tokens, priority)
+            except Exception as e:
+                logger.error(f"Engine {engine} failed: {e}")
+                errors.append(e)
+        raise self._failed(errors)
+
+    async def acompletion(self, messages, response_format="text", prompt_tokens=0, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Requests a completion without blocking the event loop, retrying, hedging and failing over as configured.
+
+        Parameters:
+        -----------
+        messages : list of dict
+            The messages in the format {"role": role, "content": content}.
+        response_format : str, optional
+            The format of the response ("text" or "json"). Default is "text".
+        prompt_tokens : int, optional
+            The prompt tokens, taken from the token quota of the rate limiter.
+        priority : int, optional
+            The rate limiter priority, rate_limiter.PRIORITY_CRITICAL to be served first.
+        **kwargs
+            Additional parameters to pass to the completion request.
+
+        Returns:
+        --------
+        tuple of (str, object)
+            The engine that answered and its completion response.
+
+        Raises:
+        -------
+        CircuitOpenError
+            If every engine is skipped by its circuit breaker.
+        Exception
+            The error of the last engine tried if every engine failed, e.g. RateLimitShed.
+        """
+        if not config.LLM_HEDGE_ENABLED or len(self.engines) < 2:
+            return await self._afailover(self.engines, messages, response_format, kwargs, prompt_tokens, priority)
+
+        primary = self.engines[0]
+        tasks = {asyncio.ensure_future(self._acall(primary, messages, response_format, kwargs, prompt_tokens, priority)): primary}
+        errors = []
+        try:
+            done, _ = await asyncio.wait(set(tasks), timeout=self.hedge_delay(primary))
+            # Hedge to the next engine whose circuit is not open
+            secondary = next((engine for engine in self.engines[1:] if self.breakers[engine].state != "open"), None)
+            if not done and secondary is not None:
+                # The primary engine is slower than usual, race it against the next one
+                metrics.LLM_DISPATCH.inc(engine=secondary, result="hedged")
+                tasks[asyncio.ensure_future(self._acall(secondary, messages, response_format, kwargs, prompt_tokens, priority))] = secondary
+            remaining = [engine for engine in self.engines if engine not in tasks.values()]
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return tasks[task], task.result()
+                    logger.error(f"Engine {tasks[task]} failed: {task.exception()}")
+                    errors.append(task.exception())
+        finally:
+            # Also when this call is cancelled: the cancelled calls release their circuit breaker reservation
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        return await self._afailover(remaining, messages, response_format, kwargs, prompt_tokens, priority, errors)
+
+    async def astream_completion(self, messages, response_format="text", prompt_tokens=0, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Requests a streamed completion, retrying and failing over until the first chunk is received.
+
+        Once a chunk has been received the stream is not retried, since the caller may already
+        have used it.
+
+        Parameters:
+        -----------
+        messages : list of dict
+            The messages in the format {"role": role, "content": content}.
+        response_format : str, optional
+            The format of the response ("text" or "json"). Default is "text".
+        prompt_tokens : int, optional
+            The prompt tokens, taken from the token quota of the rate limiter.
+        priority : int, optional
+            The rate limiter priority, rate_limiter.PRIORITY_CRITICAL to be served first.
+        **kwargs
+            Additional parameters to pass to the completion request.
+
+        Yields:
+        -------
+        tuple of (str, object)
+            The engine that answered and each of its completion chunks.
+        """
+        errors = []
+        for engine in self.engines:
+            limiter = get_rate_limiter(engine_model(engine))
+            try:
+                async for attempt in AsyncRetrying(**self._retry_options()):
+                    with attempt, self._attempt(engine) as call:
+                        await limiter.acquire(prompt_tokens, priority)
+                        call["start"] = time.perf_counter()
+                        stream = self._wrapper(engine, messages).astream_completion(response_format, **kwargs)
+                        first = await stream.__anext__()
+            except Exception as e:
+                logger.error(f"Engine {engine} failed: {e}")
+                errors.append(e)
+                continue
+
+            yield engine, first
+            async for chunk in stream:
+                yield engine, chunk
+            return
+        raise self._failed(errors)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Returns the process-wide Dispatcher, creating it on first use.
+
+    Returns:
+    --------
+    Dispatcher
+        The shared dispatcher.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher()
+    return _dispatcher
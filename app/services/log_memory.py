@@ -0,0 +1,129 @@
+import json
+from app.services.prompt_encoding import JSON_SEPARATORS, split_log
+
+# Key of the logs record data holding the summary of the evicted entries
+SUMMARY_KEY = "summary"
+
+
+def append_log(data, item, size, summarize=False):
+    """
+    Appends an entry to the logs record, evicting the oldest entries beyond its size.
+
+    The list is trimmed in place like a deque with maxlen=size, and the evicted entries are
+    folded into the summary of the record when summarize is set.
+
+    Parameters:
+    -----------
+    data : dict
+        The data of the logs record, {"logs": [...], "summary": {...}}. Updated in place.
+    item : dict
+        The new entry, with a name, a description and optionally a status.
+    size : int
+        Maximum number of entries kept.
+    summarize : bool, optional
+        Fold the evicted entries into data["summary"] instead of dropping them.
+
+    Returns:
+    --------
+    list of dict
+        The evicted entries.
+    """
+    logs = data.setdefault("logs", [])
+    logs.append(item)
+    overflow = len(logs) - max(size, 0)
+    if overflow <= 0:
+        return []
+    evicted = logs[:overflow]
+    del logs[:overflow]
+    if summarize:
+        summary = data.setdefault(SUMMARY_KEY, {"turns": 0, "actions": {}})
+        for entry in evicted:
+            fold(summary, entry)
+    return evicted
+
+
+def fold(summary, item):
+    """
+    Adds a log entry to the per-action success and error counts of a summary.
+
+    Parameters:
+    -----------
+    summary : dict
+        {"turns": int, "actions": {action: {"success": int, "error": int, "last_error": str}}}. Updated in place.
+    item : dict
+        The evicted log entry.
+    """
+    action, status, message = split_log(item)
+    counts = summary["actions"].setdefault(action, {"success": 0, "error": 0})
+    if status == "error":
+        counts["error"] += 1
+        counts["last_error"] = message
+    else:
+        counts["success"] += 1
+    summary["turns"] += 1
+
+
+def _ranked(summary):
+    """
+    Orders the actions of a summary by importance: the most failed first, then the most used.
+    """
+    return sorted(
+        summary["actions"].items(),
+        key=lambda entry: (-entry[1]["error"], -(entry[1]["success"] + entry[1]["error"]), entry[0]),
+    )
+
+
+def summary_lines(summary, max_tokens, count_tokens, encoding="verbose"):
+    """
+    Renders a summary within a token budget.
+
+    The actions are added from the most failed to the most used until the budget is spent,
+    so the size of the summary stays bounded however long the game lasts.
+
+    Parameters:
+    -----------
+    summary : dict or None
+        The summary of the logs record.
+    max_tokens : int
+        Maximum number of tokens of the rendered summary.
+    count_tokens : callable
+        Returns the number of tokens of a string, e.g. SettingsManager.num_tokens.
+    encoding : str, optional
+        The PROMPT_ENCODING, "json" renders one line of minified JSON.
+
+    Returns:
+    --------
+    list of str
+        The lines of the summary, empty if there is nothing to summarize or no budget.
+    """
+    if not summary or not summary.get("actions") or max_tokens <= 0:
+        return []
+
+    if encoding == "json":
+        counts = {}
+        for action, entry in _ranked(summary):
+            value = [entry["success"], entry["error"]] + ([entry["last_error"]] if entry.get("last_error") else [])
+            candidate = {**counts, action: value}
+            if count_tokens(_json_summary(summary, candidate)) > max_tokens:
+                break
+            counts = candidate
+        return [_json_summary(summary, counts)] if counts else []
+
+    header = f"Earlier turns ({summary['turns']}), per action:"
+    lines = [header]
+    used = count_tokens(header)
+    for action, entry in _ranked(summary):
+        line = f"{action}: {entry['success']} success, {entry['error']} error"
+        if entry.get("last_error"):
+            line += f", last error: {entry['last_error']}"
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return lines if len(lines) > 1 else []
+
+
+def _json_summary(summary, counts):
+    return json.dumps({"earlier_turns": summary["turns"], "success_error": counts},
+                      separators=JSON_SEPARATORS, ensure_ascii=False)
@@ -0,0 +1,449 @@
+import math
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from app import config
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonic counter, one series per combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Initializes a new Counter.
+
+        Parameters:
+        -----------
+        name : str
+            The metric name.
+        documentation : str
+            The help text.
+        labelnames : tuple of str, optional
+            The label names, the values are passed to inc as keyword arguments.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds to the counter.
+
+        Parameters:
+        -----------
+        amount : float, optional
+            The non-negative amount to add. Default is 1.
+        **labels
+            The label values.
+        """
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """
+        Returns the value of a series, or the sum of every series when no label is given.
+        """
+        with self._lock:
+            if not labels:
+                return sum(self._values.values())
+            return self._values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        """
+        Returns the series as a JSON-serializable list of [label values, value].
+        """
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(snapshots):
+        """
+        Sums the series of several snapshots, e.g. of several workers.
+
+        Parameters:
+        -----------
+        snapshots : list
+            Values returned by snapshot().
+
+        Returns:
+        --------
+        dict
+            The summed values keyed by label values.
+        """
+        values = {}
+        for series in snapshots:
+            for key, value in series:
+                key = tuple(key)
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def samples(self, values=None):
+        """
+        Returns the exposition lines of the counter, or of the given merged values.
+        """
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, one series per combination of label values.
+    """
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds to the gauge, or subtracts with a negative amount.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """
+        Sets the gauge.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, one series per combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Initializes a new Histogram.
+
+        Parameters:
+        -----------
+        name : str
+            The metric name.
+        documentation : str
+            The help text.
+        labelnames : tuple of str, optional
+            The label names, the values are passed to observe as keyword arguments.
+        buckets : tuple of float, optional
+            The increasing upper bounds of the buckets. A +Inf bucket is always added.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Records a value.
+
+        Parameters:
+        -----------
+        value : float
+            The observed value.
+        **labels
+            The label values.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """
+        Returns the series as a JSON-serializable list of [label values, bucket counts, sum, count].
+        """
+        with self._lock:
+            return [[list(key), list(counts), total, count] for key, (counts, total, count) in self._series.items()]
+
+    @staticmethod
+    def merge(snapshots):
+        """
+        Sums the series of several snapshots, bucket by bucket.
+
+        Parameters:
+        -----------
+        snapshots : list
+            Values returned by snapshot().
+
+        Returns:
+        --------
+        dict
+            (bucket counts, sum, count) keyed by label values.
+        """
+        series = {}
+        for entries in snapshots:
+            for key, counts, total, count in entries:
+                key = tuple(key)
+                merged = series.get(key)
+                if merged is None:
+                    series[key] = (list(counts), total, count)
+                else:
+                    series[key] = ([a + b for a, b in zip(merged[0], counts)], merged[1] + total, merged[2] + count)
+        return series
+
+    def samples(self, series=None):
+        """
+        Returns the exposition lines of the histogram, or of the given merged series.
+        """
+        if series is None:
+            with self._lock:
+                series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Set of metrics rendered together in the Prometheus text exposition format.
+
+    Besides the metrics it owns, collectors can report gauges computed on demand,
+    e.g. from the stats of the decision cache.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric to the registry and returns it.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        Adds a callable returning a list of (name, documentation, value) gauges.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def snapshot(self):
+        """
+        Returns the values of the metrics it owns, to be published for the other workers.
+
+        Returns:
+        --------
+        dict
+            {"updated_at": timestamp, "metrics": {name: {"kind": kind, "series": [...]}}}, JSON-serializable.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return {
+            "updated_at": time.time(),
+            "metrics": {metric.name: {"kind": metric.kind, "series": metric.snapshot()} for metric in metrics},
+        }
+
+    def render(self, snapshots=None):
+        """
+        Returns every metric in the Prometheus text exposition format.
+
+        Parameters:
+        -----------
+        snapshots : list of dict, optional
+            Snapshots of every worker, this one included. The metrics are then the sum over the
+            workers. The collectors always report the values of this worker.
+
+        Returns:
+        --------
+        str
+            The metrics page.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if snapshots is None:
+                lines.extend(metric.samples())
+            else:
+                series = [snapshot["metrics"][metric.name]["series"]
+                          for snapshot in snapshots if metric.name in snapshot["metrics"]]
+                lines.extend(metric.samples(metric.merge(series)))
+        for collector in collectors:
+            for name, documentation, value in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+TURN_LABELS = ("engine", "model", "approach")
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "castaway_stage_seconds", "Duration of the stages of a turn.", ("stage",) + TURN_LABELS))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "castaway_llm_tokens_total",
+    "Tokens of the LLM calls: prompt, completion and cached as reported by the provider, estimated_prompt as counted locally.",
+    ("kind",) + TURN_LABELS))
+TURNS = REGISTRY.register(Counter(
+    "castaway_turns_total", "Turns played, by how the action was decided (llm, cache, forced) or error.",
+    ("outcome",) + TURN_LABELS))
+LLM_DISPATCH = REGISTRY.register(Counter(
+    "castaway_llm_dispatch_total",
+    "LLM calls by engine and result: success, failure, hedged (second engine fired) or circuit_open (engine skipped).",
+    ("engine", "result")))
+RATE_LIMIT_QUEUE = REGISTRY.register(Gauge(
+    "castaway_rate_limit_queue_depth", "LLM calls waiting for the rate limiter of their model.", ("model",)))
+RATE_LIMIT_DECISIONS = REGISTRY.register(Counter(
+    "castaway_rate_limit_total",
+    "LLM calls seen by the rate limiter, by model, priority and result: admitted, queued or shed.",
+    ("model", "priority", "result")))
+STATE_RELOADS = REGISTRY.register(Counter(
+    "castaway_state_reloads_total", "Sessions reloaded from the state backend because another worker changed them."))
+STATE_CONFLICTS = REGISTRY.register(Counter(
+    "castaway_state_conflicts_total", "Session writes rejected because another worker changed the session first."))
+OBJECTIVE_TRANSITIONS = REGISTRY.register(Counter(
+    "castaway_objective_transitions_total", "Changes of objective, by new objective.", ("objective",)))
+
+
+def turn_labels(engine=None):
+    """
+    Returns the engine, model and approach labels of the current configuration.
+
+    Parameters:
+    -----------
+    engine : str, optional
+        The engine that answered, when it is not config.LLM_ENGINE, e.g. after a failover.
+
+    Returns:
+    --------
+    dict
+        The label values keyed by label name.
+    """
+    engine = engine or config.LLM_ENGINE
+    model = config.GPT_ENGINE if engine == "openai" else engine
+    return {"engine": engine, "model": model, "approach": config.APPROACH}
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Times the enclosed block into the stage histogram.
+
+    Parameters:
+    -----------
+    stage : str
+        The stage name, e.g. "prompt_build".
+    **labels
+        Label values overriding the ones of the current configuration.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, **{**turn_labels(), **labels})
+
+
+def record_usage(usage, **labels):
+    """
+    Adds the token usage reported by a provider to the token counter.
+
+    Parameters:
+    -----------
+    usage : dict
+        The prompt, completion and cached token counts.
+    **labels
+        Label values overriding the ones of the current configuration.
+    """
+    labels = {**turn_labels(), **labels}
+    for kind in ("prompt", "completion", "cached"):
+        amount = usage.get(f"{kind}_tokens", 0)
+        if amount:
+            LLM_TOKENS.inc(amount, kind=kind, **labels)
+
+
+def _decision_cache_gauges():
+    from app.services.decision_cache import get_decision_cache
+
+    stats = get_decision_cache().stats()
+    return [(f"castaway_decision_cache_{name}", f"Decision cache {name.replace('_', ' ')}.", value)
+            for name, value in stats.items()]
+
+
+def _agent_gauges():
+    # Only report once the AGENTIC stack is loaded, importing it just for the metrics is too costly
+    agent = sys.modules.get("services.agent")
+    if agent is None:
+        return []
+    stats = agent.round_trip_stats.snapshot()
+    return [(f"castaway_agent_round_trips_{name}", f"Agent LLM round trips per decision: {name}.", value)
+            for name, value in stats.items()]
+
+
+REGISTRY.register_collector(_decision_cache_gauges)
+REGISTRY.register_collector(_agent_gauges)
+
+
+def count_transition(transition):
+    """
+    Objective graph listener counting the objective transitions.
+
+    Parameters:
+    -----------
+    transition : ObjectiveTransition
+        The transition that happened.
+    """
+    OBJECTIVE_TRANSITIONS.inc(objective=transition.current)
@@ -0,0 +1,157 @@
+import threading
+import logging
+from app import config
+from app.helper.utils import load_from_json
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectiveTransition:
+    """
+    Event emitted when the current objective of a session changes.
+
+    Attributes:
+    -----------
+    session_id : str
+        The session whose objective changed.
+    previous : str or None
+        The name of the previous objective, None if there was none.
+    current : str
+        The name of the new objective.
+    """
+
+    def __init__(self, session_id, previous, current):
+        self.session_id = session_id
+        self.previous = previous
+        self.current = current
+
+    def __repr__(self):
+        return f"ObjectiveTransition({self.session_id!r}: {self.previous!r} -> {self.current!r})"
+
+
+class ObjectiveGraph:
+    """
+    Ordered objective stages, each unlocked by owning some items.
+
+    The current objective is the last stage whose requirements the inventory meets, so
+    later stages take precedence over earlier ones. The first stage is the objective a
+    new game starts with.
+    """
+
+    def __init__(self, stages):
+        """
+        Initializes a new ObjectiveGraph.
+
+        Parameters:
+        -----------
+        stages : list of dict
+            The stages in progression order, each with a name, a description and the
+            minimum quantity of each item it requires.
+        """
+        if not stages:
+            raise ValueError("The objective graph has no stages.")
+        self.stages = stages
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, file_path):
+        """
+        Loads the graph from a JSON file with an "objectives" list.
+
+        Parameters:
+        -----------
+        file_path : str
+            Path to the JSON file.
+
+        Returns:
+        --------
+        ObjectiveGraph
+            The objective graph.
+        """
+        return cls(load_from_json("objectives", file_path))
+
+    def current(self, inventory):
+        """
+        Returns the objective the inventory has unlocked.
+
+        Parameters:
+        -----------
+        inventory : dict
+            Quantity owned of each item, keyed by item name.
+
+        Returns:
+        --------
+        dict or None
+            The objective, with its name and description, or None if the inventory meets the
+            requirements of no stage beyond the first one.
+        """
+        for stage in reversed(self.stages):
+            requires = stage.get("requires", {})
+            if requires and all(inventory.get(item, 0) >= quantity for item, quantity in requires.items()):
+                return {"name": stage["name"], "description": stage["description"]}
+        return None
+
+    def first(self):
+        """
+        Returns the objective a new game starts with.
+
+        Returns:
+        --------
+        dict
+            The first stage, with its name and description.
+        """
+        first = self.stages[0]
+        return {"name": first["name"], "description": first["description"]}
+
+    def subscribe(self, listener):
+        """
+        Registers a callable receiving every ObjectiveTransition. Registering it again has no effect.
+
+        Parameters:
+        -----------
+        listener : callable
+            Called with the ObjectiveTransition. Errors it raises are logged and ignored.
+        """
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def emit(self, transition):
+        """
+        Sends a transition to every listener.
+
+        Parameters:
+        -----------
+        transition : ObjectiveTransition
+            The transition that happened.
+        """
+        logger.info(f"Objective changed: {transition}")
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(transition)
+            except Exception as e:
+                logger.error(f"Error in objective listener: {e}")
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_objective_graph():
+    """
+    Returns the process-wide ObjectiveGraph loaded from config.OBJECTIVE_GRAPH_FILE, loading it on first use.
+
+    Returns:
+    --------
+    ObjectiveGraph
+        The shared objective graph.
+    """
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = ObjectiveGraph.from_file(config.OBJECTIVE_GRAPH_FILE)
+    return _graph
@@ -0,0 +1,148 @@
+import json
+import re
+
+# Prompt encodings selected with config.PROMPT_ENCODING
+ENCODINGS = ("verbose", "compact", "json")
+
+# The description update_memory writes for each log entry
+LOG_PATTERN = re.compile(r"^The action '(.*)' was executed with status '(.*)' and message: '(.*)'\.$", re.DOTALL)
+
+# Separators of the minified JSON encoding
+JSON_SEPARATORS = (",", ":")
+
+
+def action_requirements(rule):
+    """
+    Abbreviates the prerequisites of an action, e.g. "2 stick, 1 stone" or "tool axe".
+
+    Parameters:
+    -----------
+    rule : ActionRule or None
+        The rule of the action, None if the action has no known prerequisite.
+
+    Returns:
+    --------
+    str
+        The prerequisites, empty if there are none.
+    """
+    if rule is None:
+        return ""
+    parts = [f"{quantity} {item}" for item, quantity in rule.ingredients.items()]
+    parts += [f"tool {tool}" for tool in rule.tools]
+    if rule.any_of:
+        parts.append(" or ".join(rule.any_of))
+    return ", ".join(parts)
+
+
+def split_log(item):
+    """
+    Splits a log entry into its action, status and message.
+
+    Parameters:
+    -----------
+    item : dict
+        The log entry, with a name and a description.
+
+    Returns:
+    --------
+    tuple of (str, str, str)
+        The action, the status (empty if it cannot be read from the entry) and the message.
+    """
+    match = LOG_PATTERN.match(item["description"])
+    if match is None:
+        return item["name"], item.get("status", ""), item["description"]
+    return match.group(1), match.group(2), match.group(3)
+
+
+def compact_lines(record_name, items, rules=None):
+    """
+    Renders the items of a record as short text lines.
+
+    Zero-quantity inventory items are left out, actions are reduced to their name and
+    prerequisites, and the repeated prose of the logs is dropped.
+
+    Parameters:
+    -----------
+    record_name : str
+        The name of the record.
+    items : list of dict
+        The items of the record to render.
+    rules : ActionRules, optional
+        The prerequisite table, used to abbreviate the actions.
+
+    Returns:
+    --------
+    list of str
+        The lines of the section, without its header.
+    """
+    if record_name == "inventory":
+        owned = [f"{item['name']} {item['quantity']}" for item in items if item.get("quantity")]
+        return [", ".join(owned) if owned else "nothing"]
+    if record_name == "player_info":
+        return [", ".join(f"{item['name']} {item['description']}" for item in items)]
+    if record_name == "actions":
+        lines = []
+        for item in items:
+            requirements = action_requirements(rules.rules.get(item["name"]) if rules else None)
+            lines.append(f"{item['name']}: {requirements}" if requirements else item["name"])
+        return lines
+    if record_name == "logs":
+        lines = []
+        for item in items:
+            action, status, message = split_log(item)
+            lines.append(f"{action} {status}: {message}" if status else f"{action}: {message}")
+        return lines
+    return [f"{item['name']}: {item['description']}" for item in items]
+
+
+def json_value(record_name, items, rules=None):
+    """
+    Converts the items of a record to the value of the minified JSON encoding.
+
+    Parameters:
+    -----------
+    record_name : str
+        The name of the record.
+    items : list of dict
+        The items of the record to render.
+    rules : ActionRules, optional
+        The prerequisite table, used to abbreviate the actions.
+
+    Returns:
+    --------
+    dict or list
+        Quantities of the owned items, prerequisites per action, [action, status, message]
+        per log entry, or the description per item name for the other records.
+    """
+    if record_name == "inventory":
+        return {item["name"]: item["quantity"] for item in items if item.get("quantity")}
+    if record_name == "actions":
+        return {item["name"]: action_requirements(rules.rules.get(item["name"]) if rules else None) for item in items}
+    if record_name == "logs":
+        return [list(split_log(item)) for item in items]
+    return {item["name"]: item["description"] for item in items}
+
+
+def render_items(encoding, record_name, items, rules=None):
+    """
+    Renders the body of a prompt section in a compact encoding.
+
+    Parameters:
+    -----------
+    encoding : str
+        "compact" for text lines or "json" for one line of minified JSON.
+    record_name : str
+        The name of the record.
+    items : list of dict
+        The items of the record to render.
+    rules : ActionRules, optional
+        The prerequisite table, used to abbreviate the actions.
+
+    Returns:
+    --------
+    list of str
+        The lines of the section, without its header.
+    """
+    if encoding == "json":
+        return [json.dumps(json_value(record_name, items, rules), separators=JSON_SEPARATORS, ensure_ascii=False)]
+    return compact_lines(record_name, items, rules)
@@ -0,0 +1,250 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from app import config
+from app.services import metrics
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# Queue priorities, lower is served first
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_NAMES = {PRIORITY_CRITICAL: "critical", PRIORITY_NORMAL: "normal"}
+
+
+class RateLimitShed(Exception):
+    """
+    Raised when a call is refused because the queue of its model is full or the wait would be too long.
+    """
+
+
+class TokenBucket:
+    """
+    Bucket refilled at a constant rate, from which each call takes an amount.
+    """
+
+    def __init__(self, per_minute):
+        """
+        Initializes a new, full TokenBucket.
+
+        Parameters:
+        -----------
+        per_minute : float
+            The refill rate per minute, which is also the capacity of the bucket.
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """
+        Returns the seconds until the amount is available, 0.0 if it already is.
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self.available
+        return max(0.0, missing / self.rate)
+
+    def backlog_time(self, amounts):
+        """
+        Returns the seconds until every amount of a backlog has been served, 0.0 if they already can be.
+        """
+        self._refill()
+        total = sum(min(amount, self.capacity) for amount in amounts)
+        return max(0.0, (total - self.available) / self.rate)
+
+    def take(self, amount):
+        """
+        Removes an amount from the bucket. Amounts above the capacity take the whole bucket.
+        """
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Client-side limiter of the requests and tokens sent to one model.
+
+    A call is admitted right away when the request and token buckets allow it and no call
+    is waiting. Otherwise it is queued, critical calls ahead of normal ones, and the queue
+    is served in order as the buckets refill. A call is shed with RateLimitShed when the
+    queue already holds max_queue calls or when it would wait more than max_wait seconds.
+    """
+
+    def __init__(self, model, requests_per_minute=None, tokens_per_minute=None, max_queue=100, max_wait=10.0):
+        """
+        Initializes a new RateLimiter.
+
+        Parameters:
+        -----------
+        model : str
+            The model the calls are sent to, used as metric label.
+        requests_per_minute : float, optional
+            The request quota, unlimited when None.
+        tokens_per_minute : float, optional
+            The prompt token quota, unlimited when None.
+        max_queue : int, optional
+            Maximum number of waiting calls.
+        max_wait : float, optional
+            Maximum seconds a call may wait for the quota.
+        """
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._queue = []  # heap of [priority, sequence, future, tokens]
+        self._sequence = itertools.count()
+        self._drainer = None
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def _take(self, tokens):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+    def _count(self, priority, result):
+        metrics.RATE_LIMIT_DECISIONS.inc(model=self.model, priority=PRIORITY_NAMES[priority], result=result)
+
+    def _shed(self, priority, reason):
+        self._count(priority, "shed")
+        logger.warning(f"Rate limit: call to {self.model} shed, {reason}")
+        raise RateLimitShed(f"Rate limit of {self.model} reached: {reason}")
+
+    def depth(self):
+        """
+        Returns the number of waiting calls.
+        """
+        return sum(1 for entry in self._queue if not entry[2].done())
+
+    async def acquire(self, tokens=0, priority=PRIORITY_NORMAL):
+        """
+        Waits until a call of the given size can be sent.
+
+        Parameters:
+        -----------
+        tokens : int, optional
+            The prompt tokens of the call.
+        priority : int, optional
+            PRIORITY_CRITICAL or PRIORITY_NORMAL.
+
+        Raises:
+        -------
+        RateLimitShed
+            If the queue is full or the call would wait more than max_wait seconds.
+        """
+        if self.requests is None and self.tokens is None:
+            return
+
+        # Cancelled or shed entries stay in the heap until the drain pops them, they do not hold up the call
+        if self.depth() == 0 and self._wait_time(tokens) == 0.0:
+            self._take(tokens)
+            self._count(priority, "admitted")
+            return
+
+        if self.depth() >= self.max_queue:
+            # A critical call takes the place of the last normal one
+            waiting = [entry for entry in self._queue if not entry[2].done()]
+            last = max(waiting, key=lambda entry: (entry[0], entry[1]))
+            if last[0] <= priority:
+                self._shed(priority, f"{self.max_queue} calls are already waiting")
+            self._count(last[0], "shed")
+            last[2].set_exception(RateLimitShed(f"Rate limit of {self.model} reached: replaced by a critical call"))
+        # Calls queued ahead of this one are served first
+        ahead = [entry[3] for entry in self._queue if entry[0] <= priority and not entry[2].done()] + [tokens]
+        estimate = max(
+            self.requests.backlog_time([1] * len(ahead)) if self.requests is not None else 0.0,
+            self.tokens.backlog_time(ahead) if self.tokens is not None else 0.0,
+        )
+        if estimate > self.max_wait:
+            self._shed(priority, f"the estimated wait of {estimate:.1f}s is above {self.max_wait}s")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [priority, next(self._sequence), future, tokens])
+        self._count(priority, "queued")
+        metrics.RATE_LIMIT_QUEUE.set(self.depth(), model=self.model)
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.ensure_future(self._drain())
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self._shed(priority, f"waited more than {self.max_wait}s")
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            metrics.RATE_LIMIT_QUEUE.set(self.depth(), model=self.model)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="rate_limit_wait",
+                                          **{**metrics.turn_labels(), "model": self.model})
+
+    async def _drain(self):
+        """
+        Admits the queued calls in priority order as the buckets refill.
+        """
+        while self._queue:
+            priority, _, future, tokens = self._queue[0]
+            if future.done():
+                # Cancelled or timed out while waiting
+                heapq.heappop(self._queue)
+                continue
+            wait = self._wait_time(tokens)
+            if wait > 0.0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._queue)
+            self._take(tokens)
+            future.set_result(None)
+            metrics.RATE_LIMIT_QUEUE.set(self.depth(), model=self.model)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model):
+    """
+    Returns the process-wide RateLimiter of a model, creating it on first use from config.RATE_LIMITS.
+
+    Parameters:
+    -----------
+    model : str
+        The model name, e.g. "gpt-4o" or "llama3-70b-8192".
+
+    Returns:
+    --------
+    RateLimiter
+        The shared limiter of the model. It admits every call when the model has no quota configured.
+    """
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                limits = config.RATE_LIMITS.get(model, {})
+                limiter = _limiters[model] = RateLimiter(
+                    model,
+                    requests_per_minute=limits.get("rpm"),
+                    tokens_per_minute=limits.get("tpm"),
+                    max_queue=config.RATE_LIMIT_MAX_QUEUE,
+                    max_wait=config.RATE_LIMIT_MAX_WAIT,
+                )
+    return limiter
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import orjson
+from app import config
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+# Game settings files served as is to the Unity client, keyed by category
+STATIC_CONFIG_FILES = {
+    "messages": "app/game_settings/messages.json",
+    "xp": "app/game_settings/xp.json",
+}
+
+
+class StaticConfigFile:
+    """
+    A game settings file served to the client, pre-serialized and tagged for conditional requests.
+
+    The file is read once and kept as JSON bytes with a strong ETag derived from them. Its
+    modification time is checked at most every reload_interval seconds, and the file is read
+    again only when it changed, so repeated requests do not touch the disk.
+    """
+
+    def __init__(self, category, file_path, reload_interval=1.0):
+        """
+        Initializes a new StaticConfigFile. Nothing is read until the first get().
+
+        Parameters:
+        -----------
+        category : str
+            The key of the served value in the file, e.g. "messages".
+        file_path : str
+            Path to the JSON file.
+        reload_interval : float, optional
+            Minimum seconds between two checks of the modification time.
+        """
+        self.category = category
+        self.file_path = file_path
+        self.reload_interval = reload_interval
+        self.body = None
+        self.etag = None
+        self._signature = None  # (mtime_ns, size) of the loaded file
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the serialized value and its ETag, reloading the file if it changed.
+
+        Returns:
+        --------
+        tuple of (bytes, str)
+            The JSON body and its quoted ETag.
+
+        Raises:
+        -------
+        ValueError
+            If the file cannot be parsed and no previous version was loaded.
+        """
+        now = time.monotonic()
+        if self.body is not None and now - self._checked_at < self.reload_interval:
+            return self.body, self.etag
+        with self._lock:
+            if self.body is None or now - self._checked_at >= self.reload_interval:
+                self._reload()
+                self._checked_at = now
+            return self.body, self.etag
+
+    def _reload(self):
+        """
+        Reads the file again if its modification time or size changed.
+        """
+        try:
+            stat = os.stat(self.file_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        if self.body is not None and signature == self._signature:
+            return
+
+        try:
+            value = []
+            if signature is not None and signature[1] > 0:
+                with open(self.file_path, 'rb') as file:
+                    value = orjson.loads(file.read()).get(self.category, [])
+        except orjson.JSONDecodeError as e:
+            if self.body is None:
+                raise ValueError(f"Error decoding JSON from file: {self.file_path}") from e
+            # Keep serving the last valid version, e.g. while the file is being edited
+            logger.error(f"Keeping the previous {self.category}, {self.file_path} is not valid JSON: {e}")
+            return
+
+        self.body = orjson.dumps(value)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self._signature = signature
+        logger.info(f"{self.category.capitalize()} loaded from {self.file_path}, ETag {self.etag}")
+
+    def matches(self, if_none_match):
+        """
+        Tells whether an If-None-Match header matches the current version.
+
+        Parameters:
+        -----------
+        if_none_match : str or None
+            The header value: "*", or a comma separated list of strong or weak ETags.
+
+        Returns:
+        --------
+        bool
+            True if the client already has the current version.
+        """
+        if not if_none_match or self.etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag.removeprefix("W/") == self.etag for tag in tags)
+
+
+def cache_control():
+    """
+    Returns the Cache-Control header of the static config responses.
+
+    Returns:
+    --------
+    str
+        "no-cache" when config.STATIC_CONFIG_MAX_AGE is 0, so clients revalidate every time and
+        get a 304 when nothing changed, "public, max-age=N" otherwise.
+    """
+    if config.STATIC_CONFIG_MAX_AGE <= 0:
+        return "no-cache"
+    return f"public, max-age={config.STATIC_CONFIG_MAX_AGE}"
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def get_static_config(category):
+    """
+    Returns the process-wide StaticConfigFile of a category, creating it on first use.
+
+    Parameters:
+    -----------
+    category : str
+        One of the STATIC_CONFIG_FILES keys.
+
+    Returns:
+    --------
+    StaticConfigFile
+        The shared file.
+    """
+    static_file = _files.get(category)
+    if static_file is None:
+        with _files_lock:
+            static_file = _files.get(category)
+            if static_file is None:
+                static_file = _files[category] = StaticConfigFile(
+                    category, STATIC_CONFIG_FILES[category], config.STATIC_CONFIG_RELOAD_INTERVAL)
+    return static_file
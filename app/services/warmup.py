@@ -0,0 +1,157 @@
+import logging
+import time
+from contextlib import contextmanager
+from app import config
+from app.services import metrics
+
+# Initialize the logger
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = metrics.REGISTRY.register(metrics.Gauge(
+    "castaway_startup_seconds", "Duration of the startup steps: imports and warm-up.", ("step", "status")))
+
+
+class StartupProfile:
+    """
+    Durations of the startup steps, reported once the service is ready.
+
+    Each step is recorded with its status: "ok", "skipped" when the configuration does not
+    need it, or "failed" when it raised. A failed step is only logged, the request that needs
+    it will then pay the cost or report the error itself.
+    """
+
+    def __init__(self):
+        self.steps = []
+
+    def add(self, step, seconds, status="ok", detail=None):
+        """
+        Records a step.
+
+        Parameters:
+        -----------
+        step : str
+            The step name.
+        seconds : float
+            The duration of the step.
+        status : str, optional
+            "ok", "skipped" or "failed".
+        detail : str, optional
+            Why the step was skipped or failed.
+        """
+        self.steps.append({"step": step, "seconds": round(seconds, 6), "status": status, "detail": detail})
+        STARTUP_SECONDS.set(seconds, step=step, status=status)
+
+    @contextmanager
+    def step(self, name):
+        """
+        Times the enclosed block as a step, recording it as failed if it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {e}")
+            self.add(name, time.perf_counter() - start, "failed", f"{type(e).__name__}: {e}")
+        else:
+            self.add(name, time.perf_counter() - start)
+
+    def skip(self, name, reason):
+        """
+        Records a step the configuration does not need.
+        """
+        self.add(name, 0.0, "skipped", reason)
+
+    def total(self):
+        """
+        Returns the total duration of the steps, in seconds.
+        """
+        return sum(step["seconds"] for step in self.steps)
+
+    def report(self):
+        """
+        Returns the profile as a dict, for the /startup/ endpoint.
+        """
+        return {"seconds": round(self.total(), 6), "steps": list(self.steps)}
+
+    def log(self):
+        """
+        Logs one line per step and the total.
+        """
+        for step in self.steps:
+            detail = f" ({step['detail']})" if step["detail"] else ""
+            logger.info(f"Startup step {step['step']}: {step['seconds'] * 1000:.1f} ms, {step['status']}{detail}")
+        logger.info(f"Startup done in {self.total() * 1000:.1f} ms")
+
+
+_profile = StartupProfile()
+
+
+def get_startup_profile():
+    """
+    Returns the profile of the process startup.
+
+    Returns:
+    --------
+    StartupProfile
+        The steps recorded so far.
+    """
+    return _profile
+
+
+def warm_up(settings_dir="app/settings", profile=None):
+    """
+    Loads what the first turn would otherwise load, for the configured approach and engines only.
+
+    - settings: the state store and the rendered prompt of the default session.
+    - static_config: the files served by /messages/ and /xp/.
+    - tiktoken: the BPE file of the configured model, by counting the prompt tokens.
+    - engine:<name>: the provider library and the pooled clients of config.LLM_ENGINE and of
+      config.LLM_FALLBACK_ENGINES.
+    - agent: the langchain agent, only when config.APPROACH is AGENTIC.
+
+    Parameters:
+    -----------
+    settings_dir : str, optional
+        The directory of the settings files.
+    profile : StartupProfile, optional
+        Receives the step durations. Defaults to the process startup profile.
+
+    Returns:
+    --------
+    StartupProfile
+        The profile the steps were recorded in.
+    """
+    from app.settings.settings_manager import SettingsManager
+    from app.settings.state_store import get_state_store
+
+    profile = profile or _profile
+    settings_manager = None
+    with profile.step("settings"):
+        settings_manager = SettingsManager(settings_dir=settings_dir, store=get_state_store(settings_dir))
+        settings_manager.action_rules()
+        settings_manager.prompt_messages()
+
+    from app.services.static_config import STATIC_CONFIG_FILES, get_static_config
+    with profile.step("static_config"):
+        for category in STATIC_CONFIG_FILES:
+            get_static_config(category).get()
+
+    if config.WARMUP_TOKENIZER and settings_manager is not None:
+        with profile.step("tiktoken"):
+            settings_manager.prompt_tokens()
+    else:
+        profile.skip("tiktoken", "WARMUP_TOKENIZER is off")
+
+    from app.services.dispatcher import create_wrapper, get_dispatcher
+    for engine in get_dispatcher().engines:
+        with profile.step(f"engine:{engine}"):
+            create_wrapper(engine).warm_up()
+
+    if config.APPROACH == "AGENTIC":
+        with profile.step("agent"):
+            from services.agent import get_agent
+            get_agent()
+    else:
+        profile.skip("agent", f"APPROACH is {config.APPROACH}")
+
+    return profile
@@ -0,0 +1,479 @@
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from app import config
+from app.helper.utils import atomic_write
+from app.services.log_memory import append_log
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows, the file backend cannot be shared between processes there
+    fcntl = None
+
+
+class StateConflictError(Exception):
+    """
+    Raised when a session was changed by another worker since it was loaded.
+    """
+
+    def __init__(self, session_id: str, expected: int, actual: int):
+        super().__init__(f"Session {session_id} was changed by another worker (revision {actual}, expected {expected}).")
+        self.session_id = session_id
+        self.expected = expected
+        self.actual = actual
+
+
+class StateBackend(ABC):
+    """
+    Abstract base class for the storage behind the StateStore.
+
+    Records are exchanged as already serialized JSON strings so the store can take a
+    consistent snapshot under its own lock and hand the write off to the backend.
+    """
+
+    @abstractmethod
+    def load_session(self, session_id: str, record_names: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Load the records of a session.
+
+        Args:
+            session_id (str): Identifier of the session.
+            record_names (List[str]): Names of the records to load.
+
+        Returns:
+            Optional[Dict[str, Any]]: Record data keyed by record name, or None if the session does not exist.
+                Records missing from the backend are left out of the result.
+        """
+        pass
+
+    @abstractmethod
+    def save_records(self, session_id: str, payloads: Dict[str, str],
+                     expected_revision: Optional[int] = None) -> Optional[int]:
+        """
+        Persist serialized records of a session.
+
+        Args:
+            session_id (str): Identifier of the session.
+            payloads (Dict[str, str]): JSON strings keyed by record name.
+            expected_revision (int, optional): Revision the records were loaded at. When given, the
+                records are only written if the session is still at that revision, and the revision is bumped.
+
+        Returns:
+            Optional[int]: The new revision of the session, None if expected_revision was not given.
+
+        Raises:
+            StateConflictError: If the session is no longer at expected_revision.
+        """
+        pass
+
+    def session_revision(self, session_id: str) -> int:
+        """
+        Return the revision of a session, bumped by every save made with an expected revision.
+
+        Args:
+            session_id (str): Identifier of the session.
+
+        Returns:
+            int: The revision, 0 if the session was never saved with an expected revision.
+        """
+        return 0
+
+    def append_item(self, session_id: str, record: str, payload: str) -> bool:
+        """
+        Durably append a single item to a record without rewriting it.
+
+        Args:
+            session_id (str): Identifier of the session.
+            record (str): Name of the record the item was appended to.
+            payload (str): The item serialized as JSON.
+
+        Returns:
+            bool: True if the item was journaled, False if the backend does not support journaling
+                and the whole record has to be saved instead.
+        """
+        return False
+
+    def publish_metrics(self, worker: str, payload: str):
+        """
+        Store the metrics snapshot of a worker, replacing its previous one.
+
+        Args:
+            worker (str): Identifier of the worker process.
+            payload (str): The snapshot serialized as JSON.
+        """
+        pass
+
+    def load_metrics(self) -> Dict[str, str]:
+        """
+        Return the last metrics snapshot published by every worker.
+
+        Returns:
+            Dict[str, str]: JSON snapshots keyed by worker.
+        """
+        return {}
+
+    def close(self):
+        """
+        Release any resource held by the backend.
+        """
+        pass
+
+
+class FileBackend(StateBackend):
+    """
+    Stores each record in its own JSON file.
+
+    The default session uses the files in the settings directory itself, so existing
+    single-game setups keep working. Other sessions live in settings_dir/sessions/<session_id>/.
+
+    Files are always replaced atomically. When config.LOGS_JOURNAL is enabled, new log entries
+    are appended to logs.journal instead, and the journal is replayed into logs.json the next
+    time the session is loaded. Saving the full record truncates the journal.
+
+    When shared, the files of a session are read under a shared flock and saved under an exclusive
+    one, on the .lock file of the session directory, and the revision is kept in its .revision file.
+    """
+
+    def __init__(self, settings_dir: str, shared: bool = False):
+        """
+        Args:
+            settings_dir (str): Directory where settings JSON files are stored.
+            shared (bool): Lock the session files, for several processes working on the same directory.
+        """
+        if shared and fcntl is None:
+            raise RuntimeError("The file backend can only be shared between processes on POSIX systems, use the sqlite backend.")
+        self.settings_dir = Path(settings_dir)
+        self.shared = shared
+
+    def _session_dir(self, session_id: str) -> Path:
+        if session_id == config.DEFAULT_SESSION_ID:
+            return self.settings_dir
+        return self.settings_dir / "sessions" / session_id
+
+    @contextmanager
+    def _locked(self, session_dir: Path, exclusive: bool):
+        """
+        Hold the flock of a session directory, when the backend is shared.
+        """
+        if not self.shared:
+            yield
+            return
+        session_dir.mkdir(parents=True, exist_ok=True)
+        with open(session_dir / ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_revision(session_dir: Path) -> int:
+        try:
+            return int((session_dir / ".revision").read_text() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def session_revision(self, session_id: str) -> int:
+        session_dir = self._session_dir(session_id)
+        if not session_dir.is_dir():
+            return 0
+        with self._locked(session_dir, exclusive=False):
+            return self._read_revision(session_dir)
+
+    def load_session(self, session_id: str, record_names: List[str]) -> Optional[Dict[str, Any]]:
+        session_dir = self._session_dir(session_id)
+        if not session_dir.is_dir():
+            return None
+
+        with self._locked(session_dir, exclusive=False):
+            records = self._load_records(session_dir, record_names)
+        for record in record_names:
+            if (session_dir / f"{record}.journal").exists():
+                self._replay_journal(session_id, record, records)
+        return records
+
+    @staticmethod
+    def _load_records(session_dir: Path, record_names: List[str]) -> Dict[str, Any]:
+        records = {}
+        for record in record_names:
+            file_path = session_dir / f"{record}.json"
+            if file_path.exists():
+                try:
+                    with open(file_path, 'r') as file:
+                        records[record] = json.load(file)
+                except json.JSONDecodeError:
+                    raise ValueError(f"Error decoding JSON from file: {file_path}")
+        return records
+
+    def _replay_journal(self, session_id: str, record: str, records: Dict[str, Any]):
+        """
+        Apply the journaled items of a record on top of its loaded data and checkpoint the result.
+        """
+        journal_path = self._session_dir(session_id) / f"{record}.journal"
+        items = []
+        with open(journal_path, 'r') as file:
+            for line in file:
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Only the last line can be partially written, when the process died mid-append
+                    logger.warning(f"Skipping truncated entry in {journal_path}")
+                    break
+        if not items:
+            return
+
+        data = records.setdefault(record, {record: []})
+        for item in items:
+            append_log(data, item, config.LOGS_SIZE, config.LOG_SUMMARY)
+        logger.info(f"Replayed {len(items)} journaled item(s) into {record} of session {session_id}")
+        self.save_records(session_id, {record: json.dumps(data, indent=4)})
+
+    def save_records(self, session_id: str, payloads: Dict[str, str],
+                     expected_revision: Optional[int] = None) -> Optional[int]:
+        session_dir = self._session_dir(session_id)
+        session_dir.mkdir(parents=True, exist_ok=True)
+        if expected_revision is None:
+            self._write_records(session_dir, payloads)
+            return None
+
+        with self._locked(session_dir, exclusive=True):
+            revision = self._read_revision(session_dir)
+            if revision != expected_revision:
+                raise StateConflictError(session_id, expected_revision, revision)
+            self._write_records(session_dir, payloads)
+            # Written last: a reader that saw the new revision also sees the new records
+            atomic_write(session_dir / ".revision", str(revision + 1))
+        return revision + 1
+
+    @staticmethod
+    def _write_records(session_dir: Path, payloads: Dict[str, str]):
+        for record, payload in payloads.items():
+            atomic_write(session_dir / f"{record}.json", payload)
+            journal_path = session_dir / f"{record}.journal"
+            if journal_path.exists() and journal_path.stat().st_size > 0:
+                # The record now contains every journaled item
+                atomic_write(journal_path, "")
+
+    def append_item(self, session_id: str, record: str, payload: str) -> bool:
+        if not config.LOGS_JOURNAL or record != "logs":
+            return False
+        session_dir = self._session_dir(session_id)
+        session_dir.mkdir(parents=True, exist_ok=True)
+        with open(session_dir / f"{record}.journal", 'a') as file:
+            file.write(payload + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        return True
+
+    def publish_metrics(self, worker: str, payload: str):
+        metrics_dir = self.settings_dir / "metrics"
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write(metrics_dir / f"{worker}.json", payload)
+
+    def load_metrics(self) -> Dict[str, str]:
+        metrics_dir = self.settings_dir / "metrics"
+        if not metrics_dir.is_dir():
+            return {}
+        return {file_path.stem: file_path.read_text() for file_path in sorted(metrics_dir.glob("*.json"))}
+
+
+class MemoryBackend(StateBackend):
+    """
+    Keeps the serialized records in a dictionary. Nothing survives a restart.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict[str, str]] = {}
+        self._revisions: Dict[str, int] = {}
+        self._metrics: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def load_session(self, session_id: str, record_names: List[str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            payloads = self._sessions.get(session_id)
+            if payloads is None:
+                return None
+            return {record: json.loads(payloads[record]) for record in record_names if record in payloads}
+
+    def save_records(self, session_id: str, payloads: Dict[str, str],
+                     expected_revision: Optional[int] = None) -> Optional[int]:
+        with self._lock:
+            revision = self._revisions.get(session_id, 0)
+            if expected_revision is not None and revision != expected_revision:
+                raise StateConflictError(session_id, expected_revision, revision)
+            self._sessions.setdefault(session_id, {}).update(payloads)
+            self._revisions[session_id] = revision + 1
+        return revision + 1 if expected_revision is not None else None
+
+    def session_revision(self, session_id: str) -> int:
+        with self._lock:
+            return self._revisions.get(session_id, 0)
+
+    def publish_metrics(self, worker: str, payload: str):
+        with self._lock:
+            self._metrics[worker] = payload
+
+    def load_metrics(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._metrics)
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Stores the records in a single SQLite table through SQLAlchemy, one row per session and record.
+
+    The database is opened in WAL mode, so the workers sharing it read while another one writes,
+    and writes wait up to config.STATE_DB_BUSY_TIMEOUT seconds for each other. The revision of each
+    session is kept in its own table and checked in the same transaction as the write.
+    """
+
+    def __init__(self, db_url: str):
+        """
+        Args:
+            db_url (str): SQLAlchemy database URL, e.g. "sqlite:///app/settings/state.db".
+        """
+        from sqlalchemy import create_engine, event, MetaData, Table, Column, Integer, String, Text
+
+        self.engine = create_engine(db_url)
+        event.listen(self.engine, "connect", self._configure_connection)
+        metadata = MetaData()
+        self.table = Table(
+            "game_state",
+            metadata,
+            Column("session_id", String(64), primary_key=True),
+            Column("record", String(64), primary_key=True),
+            Column("data", Text, nullable=False),
+        )
+        self.revisions = Table(
+            "session_revisions",
+            metadata,
+            Column("session_id", String(64), primary_key=True),
+            Column("revision", Integer, nullable=False),
+        )
+        self.metrics = Table(
+            "worker_metrics",
+            metadata,
+            Column("worker", String(128), primary_key=True),
+            Column("data", Text, nullable=False),
+        )
+        metadata.create_all(self.engine)
+
+    @staticmethod
+    def _configure_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Safe with WAL: a power loss can only lose the last transactions, never corrupt the database
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.STATE_DB_BUSY_TIMEOUT * 1000)}")
+        cursor.close()
+
+    def load_session(self, session_id: str, record_names: List[str]) -> Optional[Dict[str, Any]]:
+        from sqlalchemy import select
+
+        query = select(self.table.c.record, self.table.c.data).where(self.table.c.session_id == session_id)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).all()
+        if not rows:
+            return None
+        return {record: json.loads(data) for record, data in rows if record in record_names}
+
+    def session_revision(self, session_id: str) -> int:
+        from sqlalchemy import select
+
+        query = select(self.revisions.c.revision).where(self.revisions.c.session_id == session_id)
+        with self.engine.connect() as connection:
+            return connection.execute(query).scalar() or 0
+
+    def save_records(self, session_id: str, payloads: Dict[str, str],
+                     expected_revision: Optional[int] = None) -> Optional[int]:
+        from sqlalchemy import update
+        from sqlalchemy.dialects.sqlite import insert
+
+        if not payloads and expected_revision is None:
+            return None
+        with self.engine.begin() as connection:
+            # Bump the revision first: the update takes the write lock, so the check and the write are atomic
+            if expected_revision is None:
+                bump = insert(self.revisions).values(session_id=session_id, revision=1)
+                connection.execute(bump.on_conflict_do_update(
+                    index_elements=[self.revisions.c.session_id],
+                    set_={"revision": self.revisions.c.revision + 1},
+                ))
+            elif expected_revision == 0:
+                bump = insert(self.revisions).values(session_id=session_id, revision=1).on_conflict_do_nothing()
+                if connection.execute(bump).rowcount != 1:
+                    self._conflict(connection, session_id, expected_revision)
+            else:
+                bump = (
+                    update(self.revisions)
+                    .where(self.revisions.c.session_id == session_id)
+                    .where(self.revisions.c.revision == expected_revision)
+                    .values(revision=expected_revision + 1)
+                )
+                if connection.execute(bump).rowcount != 1:
+                    self._conflict(connection, session_id, expected_revision)
+
+            if payloads:
+                statement = insert(self.table).values(
+                    [{"session_id": session_id, "record": record, "data": payload} for record, payload in payloads.items()]
+                )
+                statement = statement.on_conflict_do_update(
+                    index_elements=[self.table.c.session_id, self.table.c.record],
+                    set_={"data": statement.excluded.data},
+                )
+                connection.execute(statement)
+        return expected_revision + 1 if expected_revision is not None else None
+
+    def _conflict(self, connection, session_id: str, expected_revision: int):
+        from sqlalchemy import select
+
+        query = select(self.revisions.c.revision).where(self.revisions.c.session_id == session_id)
+        raise StateConflictError(session_id, expected_revision, connection.execute(query).scalar() or 0)
+
+    def publish_metrics(self, worker: str, payload: str):
+        from sqlalchemy.dialects.sqlite import insert
+
+        statement = insert(self.metrics).values(worker=worker, data=payload)
+        statement = statement.on_conflict_do_update(index_elements=[self.metrics.c.worker], set_={"data": payload})
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+
+    def load_metrics(self) -> Dict[str, str]:
+        from sqlalchemy import select
+
+        with self.engine.connect() as connection:
+            return dict(connection.execute(select(self.metrics.c.worker, self.metrics.c.data)).all())
+
+    def close(self):
+        self.engine.dispose()
+
+
+def create_backend(name: str, settings_dir: str) -> StateBackend:
+    """
+    Build the state backend selected in the configuration.
+
+    Args:
+        name (str): One of "file", "memory" or "sqlite".
+        settings_dir (str): Directory where settings JSON files are stored.
+
+    Returns:
+        StateBackend: The backend instance.
+    """
+    if name == "file":
+        return FileBackend(settings_dir, shared=config.STATE_SHARED)
+    if name == "memory":
+        if config.STATE_SHARED:
+            logger.warning("STATE_SHARED is set but the memory backend is private to each worker.")
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend(config.STATE_DB_URL)
+    raise ValueError(f"Unknown state backend: {name}")
@@ -1,24 +1,50 @@
 import json
+import hashlib
 from pathlib import Path
-from typing import Dict, Any
-import config
-import tiktoken
+from typing import Dict, Any, List, Optional, Tuple
+from app import config
 import logging
 from app.validation.pydantic_val import ActionRequest
+from app.helper.utils import atomic_write
+from app.helper import tokens
+from app.services.action_rules import ActionRules
+from app.services import prompt_encoding
+from app.services.log_memory import SUMMARY_KEY, append_log, summary_lines
+from app.services.objective_graph import ObjectiveTransition, get_objective_graph
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SettingsManager:
-    def __init__(self, settings_dir: str):
+    def __init__(self, settings_dir: str, store=None, session_id: str = None):
         """
         Initialize the SettingsManager with a directory containing settings files.
         
         Args:
             settings_dir (str): Directory where settings JSON files are stored.
+            store (StateStore, optional): Shared in-memory state store. When given, records are
+                taken from the store instead of being read from disk, and saving a record only
+                marks it dirty in the store.
+            session_id (str, optional): Session whose records are managed when a store is given.
+                Defaults to config.DEFAULT_SESSION_ID.
         """
         self.settings_dir = Path(settings_dir)
+        self.store = store
+        self.session = None
+        if store is not None:
+            self.session = store.get_session(session_id)
+            self.session_id = self.session.session_id
+            self.memory = self.session.memory
+            self.records = self.session.records
+            self.versions = self.session.versions
+            self.cache = self.session.cache
+            return
+
+        self.session_id = config.DEFAULT_SESSION_ID
+        self.versions = {}
+        self.cache = {}
+
         self.memory = self._load_json("memory.json")
         self.records = {
             record["name"]: {
@@ -59,14 +85,48 @@ class SettingsManager:
         """
         file_path = self.settings_dir / file_name
         try:
-            with open(file_path, 'w') as file:
-                json.dump(data, file, indent=4)
+            atomic_write(file_path, json.dumps(data, indent=4))
         except Exception as e:
             raise RuntimeError(f"An error occurred while saving file {file_name}: {e}")
 
+    def _touch(self, record: str):
+        """
+        Bump the version of a record, invalidating every cached value derived from it.
+        
+        Args:
+            record (str): Name of the record that changed.
+        """
+        self.versions[record] = self.versions.get(record, 0) + 1
+
+    def _cached(self, key: str, records, compute, extra=None):
+        """
+        Return a value derived from one or more records, recomputing it only when one of them changed.
+        
+        Args:
+            key (str): Name of the derived value.
+            records (Union[str, Tuple[str, ...]]): Name(s) of the record(s) the value is derived from.
+            compute (Callable[[], Any]): Computes the value from the current records.
+            extra (Hashable, optional): Any other input of the value, it is recomputed when this changes too.
+        
+        Returns:
+            Any: The cached or freshly computed value.
+        """
+        if isinstance(records, str):
+            records = (records,)
+        version = tuple(self.versions.get(record, 0) for record in records) + (extra,)
+        cached = self.cache.get((key, records))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = compute()
+        self.cache[(key, records)] = (version, value)
+        return value
+
     def load_record(self, record: str) -> Dict[str, Any]:
         """
         Load data for a specific record.
+
+        The returned data is the live record: call save_record after mutating it so the
+        cached prompt sections and token counts are invalidated.
         
         Args:
             record (str): Name of the record to load.
@@ -84,7 +144,11 @@ class SettingsManager:
             record (str): Name of the record to save.
         """
         if record in self.records:
-            self._save_json(f"{record}.json", self.records[record]["data"])
+            self._touch(record)
+            if self.store is not None:
+                self.store.mark_dirty(self.session_id, record)
+            else:
+                self._save_json(f"{record}.json", self.records[record]["data"])
 
     def add_item(self, record: str, item: Dict[str, Any]):
         """
@@ -96,10 +160,16 @@ class SettingsManager:
         """
         if record in self.records:
             if record == "logs":
-                if len(self.records[record]["data"][record]) >= config.LOGS_SIZE:
-                    self.records[record]["data"][record].pop(0)
-            self.records[record]["data"][record].append(item)
-            self.save_record(record)
+                # Keep the last config.LOGS_SIZE entries, the older ones are folded into the summary
+                append_log(self.records[record]["data"], item, config.LOGS_SIZE, config.LOG_SUMMARY)
+            else:
+                self.records[record]["data"][record].append(item)
+            if self.store is not None and record == "logs":
+                # Logs only ever grow at the tail, the store can journal the new entry instead of rewriting the record
+                self._touch(record)
+                self.store.append_item(self.session_id, record, item)
+            else:
+                self.save_record(record)
         else:
             raise ValueError(f"Record {record} not found.")
         
@@ -148,11 +218,38 @@ class SettingsManager:
             record (str): Name of the record to reset.
         """
         if record in self.records:
+            # Drop the derived data too, e.g. the summary of the logs
+            self.records[record]["data"].clear()
             self.records[record]["data"][record] = []
             self.save_record(record)
         else:
             raise ValueError(f"Record {record} not found.")
 
+    def record_json(self, record: str) -> str:
+        """
+        Get the JSON serialization of a specific record, as stored in its file.
+
+        The serialization is computed once and reused until the record is mutated through this class.
+        
+        Args:
+            record (str): Name of the record.
+        
+        Returns:
+            str: The record data in JSON format.
+        """
+        if record not in self.records:
+            raise ValueError(f"Record {record} not found.")
+        return self._cached("json", record, lambda: json.dumps(self.records[record]["data"]))
+
+    def records_json(self) -> Dict[str, str]:
+        """
+        Get the JSON serialization of every record, e.g. to read them once the session lock is released.
+        
+        Returns:
+            Dict[str, str]: The record data in JSON format, keyed by record name.
+        """
+        return {record: self.record_json(record) for record in self.records}
+
     def record_to_string(self, record: str) -> str:
         """
         Get a string representation of a specific record.
@@ -173,47 +270,354 @@ class SettingsManager:
             return result.strip()
         return "{}"
 
+    def record_section(self, record_name: str, with_description: bool = True, prefilter: bool = True) -> str:
+        """
+        Get the prompt section of a specific record, as used by all_records_to_string.
+
+        The section is rendered once and reused until the record is mutated through this class.
+        
+        Args:
+            record_name (str): Name of the record.
+            with_description (bool): Include the record description in the header.
+            prefilter (bool): Only list the feasible actions when config.ACTION_PREFILTER is on.
+        
+        Returns:
+            str: The record header followed by one line per item.
+        """
+        key = ("section" if with_description else "state_section") + ("" if prefilter else "_full")
+        return self._cached(key, record_name, lambda: self._render_section(record_name, with_description, prefilter),
+                            extra=self._section_variant((record_name,), prefilter))
+
+    def _render_section(self, record_name: str, with_description: bool = True, prefilter: bool = True) -> str:
+        """
+        Render the prompt section of a specific record.
+        
+        Args:
+            record_name (str): Name of the record.
+            with_description (bool): Include the record description in the header.
+            prefilter (bool): Only list the feasible actions when config.ACTION_PREFILTER is on.
+        
+        Returns:
+            str: The record header followed by one line per item.
+        """
+        if config.PROMPT_ENCODING != "verbose":
+            return self._render_compact_section(record_name, prefilter)
+        record_content = self.records[record_name]
+        record_description = record_content["description"]
+        record_data = record_content["data"]
+        if with_description:
+            lines = [f"{record_name.capitalize()} ({record_description}):"]
+        else:
+            lines = [f"{record_name.capitalize()}:"]
+        items = record_data.get(record_name, [])
+        if record_name == 'logs':
+            lines += self.log_summary_lines()
+        
+        if record_name == 'inventory':
+            for item in items:
+                lines.append(f"{item['name']}: {item['description']} (You own {item['quantity']} {item['name']})")
+        elif record_name == 'actions' and config.ACTION_PREFILTER and prefilter:
+            feasible = self.feasible_actions()
+            for item in items:
+                if item['name'] in feasible:
+                    lines.append(f"{item['name']}: {item['description']}")
+        else:
+            for item in items:
+                lines.append(f"{item['name']}: {item['description']}")
+        
+        return "\n".join(lines)
+
+    def _render_compact_section(self, record_name: str, prefilter: bool = True) -> str:
+        """
+        Render the prompt section of a specific record in the compact or json encoding.
+
+        The header never carries the record description, it is sent once in the static prefix.
+        
+        Args:
+            record_name (str): Name of the record.
+            prefilter (bool): Only list the feasible actions when config.ACTION_PREFILTER is on.
+        
+        Returns:
+            str: The record header followed by the encoded items.
+        """
+        items = self.records[record_name]["data"].get(record_name, [])
+        rules = None
+        if record_name == 'actions':
+            rules = self.action_rules()
+            if config.ACTION_PREFILTER and prefilter:
+                feasible = self.feasible_actions()
+                items = [item for item in items if item['name'] in feasible]
+        lines = [f"{record_name.capitalize()}:"]
+        if record_name == 'logs':
+            lines += self.log_summary_lines()
+        lines += prompt_encoding.render_items(config.PROMPT_ENCODING, record_name, items, rules)
+        return "\n".join(lines)
+
+    def log_summary_lines(self) -> List[str]:
+        """
+        Get the summary of the log entries older than the last config.LOGS_SIZE ones, within
+        config.LOG_SUMMARY_MAX_TOKENS tokens.
+        
+        Returns:
+            List[str]: The summary lines, empty when config.LOG_SUMMARY is off or nothing was evicted yet.
+        """
+        if not config.LOG_SUMMARY:
+            return []
+        summary = self.records["logs"]["data"].get(SUMMARY_KEY)
+        return summary_lines(summary, config.LOG_SUMMARY_MAX_TOKENS, self.num_tokens, config.PROMPT_ENCODING)
+
     def all_records_to_string(self) -> str:
         """
         Get a string representation of all records.
         
+        Only the sections of the records that changed since the last call are rendered again.
+        With a compact config.PROMPT_ENCODING, it is the static prefix followed by the dynamic
+        state, so the record descriptions are only sent once.
+        
         Returns:
             str: String representation of all records.
         """
-        result = ""
-        for record_name, record_content in self.records.items():
-            record_description = record_content["description"]
-            record_data = record_content["data"]
-            result += f"{record_name.capitalize()} ({record_description}):\n"
-            items = record_data.get(record_name, [])
-            
-            if record_name == 'inventory':
-                for item in items:
-                    result += f"{item['name']}: {item['description']} (You own {item['quantity']} {item['name']})\n"
+        if config.PROMPT_ENCODING != "verbose":
+            return f"{self.static_prefix()}\n\n{self.dynamic_state()}"
+        return self._cached("prompt", tuple(self.records), lambda: "\n\n".join(
+            self.record_section(record_name) for record_name in self.records
+        ).strip(), extra=self._section_variant(tuple(self.records)))
+
+    def _static_records(self) -> Tuple[str, ...]:
+        """
+        Names of the records sent in the static prompt prefix, in memory.json order.
+        """
+        return tuple(record for record in self.records if record in config.STATIC_RECORDS)
+
+    def _dynamic_records(self) -> Tuple[str, ...]:
+        """
+        Names of the records sent in the dynamic game state, in memory.json order.
+        """
+        return tuple(record for record in self.records if record not in config.STATIC_RECORDS)
+
+    def static_prefix(self) -> str:
+        """
+        Get the part of the prompt that does not change from one turn to the next.
+
+        It holds the full sections of the records listed in config.STATIC_RECORDS followed by the
+        descriptions of the other records, so it is byte-identical across turns and can hit the
+        provider prompt cache. With a compact config.PROMPT_ENCODING, the descriptions of every
+        record are listed there instead of in the section headers. The actions are listed in full
+        even with config.ACTION_PREFILTER, the feasible ones are named in the dynamic state.
+        
+        Returns:
+            str: The static prompt prefix.
+        """
+        def render():
+            sections = [self.record_section(record, prefilter=False) for record in self._static_records()]
+            if config.PROMPT_LAYOUT == "split":
+                guide = ["Records (their current content is given in the next message):"]
             else:
-                for item in items:
-                    result += f"{item['name']}: {item['description']}\n"
-            
-            result += "\n"
-        return result.strip()
+                guide = ["Records (their current content is given below):"]
+            described = self._dynamic_records() if config.PROMPT_ENCODING == "verbose" else tuple(self.records)
+            for record in described:
+                guide.append(f"{record.capitalize()}: {self.records[record]['description']}")
+            sections.append("\n".join(guide))
+            return "\n\n".join(sections).strip()
+
+        return self._cached("static_prefix", self._static_records(), render, extra=self._prefix_variant())
+
+    def dynamic_state(self) -> str:
+        """
+        Get the part of the prompt that changes from turn to turn: the content of every record
+        not listed in config.STATIC_RECORDS, without the record descriptions, followed by the
+        feasible actions when they are pruned from a static actions section.
+        
+        Returns:
+            str: The dynamic game state.
+        """
+        feasible_line = self._feasible_line()
+
+        def render():
+            sections = [self.record_section(record, with_description=False) for record in self._dynamic_records()]
+            if feasible_line:
+                sections.append(feasible_line)
+            return "\n\n".join(sections).strip()
+
+        return self._cached("dynamic_state", self._dynamic_records(), render,
+                            extra=(self._section_variant(self._dynamic_records()), feasible_line))
+
+    def _feasible_line(self) -> Optional[str]:
+        """
+        Get the line naming the feasible actions, when config.ACTION_PREFILTER is on and the actions
+        are sent in full in the static prefix.
+        
+        Returns:
+            Optional[str]: The line, or None if the actions section is pruned itself or not pruned at all.
+        """
+        if not config.ACTION_PREFILTER or "actions" not in self._static_records():
+            return None
+        return f"Feasible actions: {', '.join(self.feasible_actions())}"
+
+    def prompt_messages(self) -> List[Dict[str, str]]:
+        """
+        Get the prompt as chat messages, laid out according to config.PROMPT_LAYOUT.
+
+        - single: one system message with all_records_to_string.
+        - split: a system message with the static prefix followed by a user message with the dynamic state.
+        
+        Returns:
+            List[Dict[str, str]]: Messages in the format {"role": role, "content": content}.
+        """
+        if config.PROMPT_LAYOUT == "split":
+            return [
+                {"role": "system", "content": self.static_prefix()},
+                {"role": "user", "content": self.dynamic_state()},
+            ]
+        return [{"role": "system", "content": self.all_records_to_string()}]
+
+    def action_rules(self) -> ActionRules:
+        """
+        Get the recipe and prerequisite table parsed from the actions record.
+
+        The table is built once and reused until the actions record is mutated through this class.
+        
+        Returns:
+            ActionRules: The prerequisite table of the actions catalogue.
+        """
+        return self._cached("action_rules", "actions", lambda: ActionRules.from_catalogue(
+            self.load_record("actions").get("actions", []),
+            [item["name"] for item in self.load_record("inventory").get("inventory", [])],
+        ))
+
+    def inventory_quantities(self) -> Dict[str, int]:
+        """
+        Get the quantity owned of each inventory item.
+        
+        Returns:
+            Dict[str, int]: Quantities keyed by item name.
+        """
+        return {item["name"]: item["quantity"] for item in self.load_record("inventory").get("inventory", [])}
+
+    def feasible_actions(self) -> Tuple[str, ...]:
+        """
+        Get the actions of the catalogue the current inventory allows.
+        
+        Returns:
+            Tuple[str, ...]: Names of the feasible actions, in the catalogue order.
+        """
+        return self._cached("feasible_actions", ("actions", "inventory"),
+                            lambda: self.action_rules().feasible(self.inventory_quantities()))
+
+    def _section_variant(self, records: Tuple[str, ...], prefilter: bool = True):
+        """
+        Input of the rendered sections of records that is not part of their own data: the prompt
+        encoding, the feasible actions when the actions section is pruned, and the log summary settings.
+        """
+        pruned = config.ACTION_PREFILTER and prefilter and "actions" in records
+        feasible = self.feasible_actions() if pruned else None
+        summary = (config.LOG_SUMMARY, config.LOG_SUMMARY_MAX_TOKENS) if "logs" in records else None
+        return config.PROMPT_ENCODING, feasible, summary
+
+    def _prefix_variant(self):
+        """
+        Input of the static prefix that is not part of the static records.
+        """
+        return self._section_variant(self._static_records(), prefilter=False), config.PROMPT_LAYOUT
+
+    def forced_action(self) -> Optional[Tuple[str, str]]:
+        """
+        Get the move the current player state leaves no choice about, e.g. drink when thirst is Critical.
+        
+        Returns:
+            Optional[Tuple[str, str]]: The action and its observation, or None if the LLM has to decide.
+        """
+        player_info = {item["name"]: item["description"] for item in self.load_record("player_info").get("player_info", [])}
+        return self.action_rules().forced_action(player_info, self.inventory_quantities())
+
+    def state_fingerprint(self, last_logs: int = None) -> str:
+        """
+        Get a canonical hash of the game state that drives a decision.
 
+        Two turns with the same player_info levels, inventory quantities, objectives and last
+        log entries, on the same model, prompt layout and encoding, get the same fingerprint.
+        
+        Args:
+            last_logs (int, optional): Number of trailing log entries to include. Defaults to config.DECISION_CACHE_LOGS.
+        
+        Returns:
+            str: Hex digest of the normalized state.
+        """
+        last_logs = config.DECISION_CACHE_LOGS if last_logs is None else last_logs
+        logs = self.load_record("logs").get("logs", [])
+        state = {
+            "model": tokens.default_model(),
+            "layout": config.PROMPT_LAYOUT,
+            "encoding": config.PROMPT_ENCODING,
+            "player_info": {item["name"]: item["description"] for item in self.load_record("player_info").get("player_info", [])},
+            "inventory": self.inventory_quantities(),
+            "prefilter": config.ACTION_PREFILTER,
+            "objectives": [item["name"] for item in self.load_record("objectives").get("objectives", [])],
+            "logs": [item["description"] for item in logs[-last_logs:]] if last_logs > 0 else [],
+        }
+        if config.LOG_SUMMARY:
+            summary = self.load_record("logs").get(SUMMARY_KEY, {})
+            state["failed_actions"] = sorted(
+                action for action, counts in summary.get("actions", {}).items() if counts["error"]
+            )
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
 
-    def num_tokens(self, string, encoding_name="cl100k_base"):
+    def num_tokens(self, string, encoding_name=None):
         """
-        Returns the number of tokens in a text string using the specified encoding, defaulting to UTF-8.
+        Returns the number of tokens in a text string.
 
         Parameters:
         -----------
-        encoding_name : str
-            The name of the encoding to use for counting tokens.
+        string : str
+            The text to count the tokens of.
+        encoding_name : str, optional
+            The name of the encoding to use. Defaults to the encoding of the configured model.
 
         Returns:
         --------
         int
             The number of tokens in the text string.
         """
-        encoding = tiktoken.get_encoding(encoding_name)
-        return len(encoding.encode(string))
+        return tokens.num_tokens(string, encoding_name=encoding_name)
+
+    def record_tokens(self, record: str, with_description: bool = True) -> int:
+        """
+        Returns the number of tokens in the prompt section of a record, only re-encoding it when the record changed.
+        
+        Args:
+            record (str): Name of the record.
+            with_description (bool): Count the section with the record description in the header.
+        
+        Returns:
+            int: The number of tokens in the record section.
+        """
+        key = "tokens" if with_description else "state_tokens"
+        return self._cached(key, record, lambda: self.num_tokens(self.record_section(record, with_description)),
+                            extra=self._section_variant((record,)))
+
+    def prompt_tokens(self) -> int:
+        """
+        Returns the number of tokens of the prompt from the per-record counts, for the configured layout.
+
+        Tokens can merge across the blank line separating two sections, so the total may be
+        off by a token or so per section compared to encoding the whole prompt.
+        
+        Returns:
+            int: The number of tokens in the prompt.
+        """
+        separator = self.num_tokens("\n\n")
+        if config.PROMPT_LAYOUT == "split" or config.PROMPT_ENCODING != "verbose":
+            dynamic_records = self._dynamic_records()
+            prefix_tokens = self._cached("static_prefix_tokens", self._static_records(),
+                                         lambda: self.num_tokens(self.static_prefix()),
+                                         extra=self._prefix_variant())
+            state_tokens = sum(self.record_tokens(record, with_description=False) for record in dynamic_records)
+            total = prefix_tokens + state_tokens + separator * (len(dynamic_records) - 1)
+            if config.PROMPT_LAYOUT != "split":
+                # The prefix and the state are sent in the same message
+                total += separator
+            return total
+        return sum(self.record_tokens(record) for record in self.records) + separator * (len(self.records) - 1)
     
 
     def update_memory(self, action_request: ActionRequest):
@@ -239,7 +643,7 @@ class SettingsManager:
 
             # Add new log
             full_log = f"The action '{action}' was executed with status '{status}' and message: '{message}'."
-            self.add_item('logs', {"name": action, "description": full_log})
+            self.add_item('logs', {"name": action, "description": full_log, "status": status})
 
             # Update inventory
             current_inventory = self.load_record('inventory')['inventory']
@@ -283,24 +687,33 @@ class SettingsManager:
         
 
     def updateObjectives(self, inventory):
-        
-        if (inventory.shelter > 0 ):
-            self.reset_record("objectives")
-            self.add_item('objectives', {
-                "name": "Build Firepit",
-                "description": "Build a firepit to decrease stress. You need 4 sticks and 6 stones"
-            })
-
-        if (inventory.firepit > 0):
-            self.reset_record("objectives")
-            self.add_item('objectives', {
-                "name": "Craft a compass",
-                "description": "Craft a compass needed to navigate with the raft. You need 2 gold 3 iron"
-            })
-        
-        if (inventory.compass > 0):
-            self.reset_record("objectives")
-            self.add_item('objectives', {
-                "name": "Craft a raft",
-                "description": "Build a raft to leave the remote island. You need 15 woods, 5 sticks, 3 ropes, 1 sail and 1 compass"
-            })
+        """
+        Set the objective the inventory has unlocked in the objective graph.
+
+        The objectives record is only rewritten when the objective actually changes, and the
+        change is emitted to the graph listeners.
+
+        Args:
+            inventory (Inventory): Inventory received with the action request.
+
+        Returns:
+            Optional[ObjectiveTransition]: The transition, or None if the objective did not change.
+        """
+        graph = get_objective_graph()
+        objective = graph.current(inventory.model_dump())
+        objectives = self.load_record("objectives").get("objectives", [])
+        if objective is None:
+            # No stage unlocked yet: keep the current objective, or start from the first one
+            if objectives:
+                return None
+            objective = graph.first()
+        if objectives == [objective]:
+            return None
+
+        previous = objectives[-1]["name"] if objectives else None
+        self.records["objectives"]["data"]["objectives"] = [objective]
+        self.save_record("objectives")
+
+        transition = ObjectiveTransition(self.session_id, previous, objective["name"])
+        graph.emit(transition)
+        return transition
@@ -0,0 +1,541 @@
+import copy
+import json
+import os
+import socket
+import threading
+import logging
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+from app import config
+from app.settings.backends import StateBackend, StateConflictError, create_backend
+from app.services import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ("sync", "interval", "on_shutdown")
+
+
+class SessionState:
+    """
+    In-memory records of a single game session.
+
+    Attributes:
+        session_id (str): Identifier of the session.
+        memory (list): Record definitions from memory.json.
+        records (dict): Record descriptions and data keyed by record name, in the SettingsManager layout.
+        lock (threading.RLock): Guards the records while they are mutated or snapshotted.
+        versions (dict): Change counter per record name, bumped on every mutation.
+        cache (dict): Values derived from the records, tagged with the record version they were computed from.
+        revision (Optional[int]): Backend revision the records were loaded or last saved at, with a shared
+            store. None once a write was rejected, so the session is reloaded on its next transaction.
+        transaction_depth (int): Number of nested transactions open on the session.
+    """
+
+    def __init__(self, session_id: str, memory: list, records: dict, revision: Optional[int] = 0):
+        self.session_id = session_id
+        self.memory = memory
+        self.records = records
+        self.lock = threading.RLock()
+        self.versions = {}
+        self.cache = {}
+        self.revision = revision
+        self.transaction_depth = 0
+
+
+class StateStore:
+    """
+    Process-resident game state for any number of sessions, with write-behind persistence.
+
+    Sessions are loaded from the backend on first use and then shared by every
+    SettingsManager built on top of the store. Mutations only mark a record as dirty;
+    dirty records are written back according to the durability mode:
+
+    - sync: the record is written as soon as it is marked dirty.
+    - interval: a background thread writes all dirty records every flush_interval seconds.
+    - on_shutdown: dirty records are only written when the store is closed.
+
+    Marking the same record dirty several times between two flushes results in a single write.
+    At most max_sessions sessions are kept: beyond it the least recently used one is flushed and
+    dropped, and loaded again from the backend the next time it is used. A dropped session that
+    is still referenced, e.g. by a turn in flight, stays reachable until it is released.
+    Items appended to a journaled record are written to the backend journal right away and the
+    full record is only checkpointed by the background flush, on close, or every
+    config.JOURNAL_CHECKPOINT_EVERY items.
+
+    A shared store works with other processes on the same backend, e.g. the workers of
+    uvicorn --workers N or several nodes on the same database. Each session carries the backend
+    revision it was loaded at. A transaction reloads the session if another worker saved it since,
+    and writes the records changed during the transaction in one save, checked against that
+    revision: if another worker saved the session in the meantime the save is rejected with a
+    StateConflictError and the session is reloaded on its next transaction. Records are written
+    through (the durability is "sync") and nothing is journaled. The metrics of the worker are
+    published to the backend every config.METRICS_PUBLISH_INTERVAL seconds.
+    """
+
+    def __init__(self, settings_dir: str, durability: str = None, flush_interval: float = None,
+                 backend: StateBackend = None, shared: bool = None, max_sessions: int = None):
+        """
+        Initialize the StateStore and load the record templates from the settings directory.
+
+        Args:
+            settings_dir (str): Directory where settings JSON files are stored.
+            durability (str): One of "sync", "interval" or "on_shutdown". Defaults to config.STATE_DURABILITY.
+            flush_interval (float): Seconds between background flushes. Defaults to config.STATE_FLUSH_INTERVAL.
+            backend (StateBackend): Storage for the sessions. Defaults to the backend named in config.STATE_BACKEND.
+            shared (bool): Work with other processes on the same backend. Defaults to config.STATE_SHARED.
+            max_sessions (int): Sessions kept in memory, 0 for no limit. Defaults to config.STATE_MAX_SESSIONS.
+        """
+        from app.settings.settings_manager import SettingsManager
+
+        self.settings_dir = Path(settings_dir)
+        self.shared = config.STATE_SHARED if shared is None else shared
+        self.durability = durability or config.STATE_DURABILITY
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {self.durability}")
+        if self.shared and self.durability != "sync":
+            # Other workers must see a change as soon as the turn that made it is over
+            logger.info(f"Shared state store: using the sync durability instead of {self.durability}")
+            self.durability = "sync"
+        self.flush_interval = flush_interval if flush_interval is not None else config.STATE_FLUSH_INTERVAL
+        self.backend = backend or create_backend(config.STATE_BACKEND, settings_dir)
+
+        # Guards the session table and the dirty set. Never acquire a session lock while holding it.
+        self.lock = threading.RLock()
+        # Sessions in least recently used order, and the dropped ones that are still referenced
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self.max_sessions = config.STATE_MAX_SESSIONS if max_sessions is None else max_sessions
+        self._dirty = set()
+        # Journaled item counts per (session_id, record) since the last checkpoint
+        self._journaled: Dict[tuple, int] = {}
+        self._closed = False
+
+        # The files in the settings directory are the template every new session starts from
+        template = SettingsManager(settings_dir=settings_dir)
+        self.memory = template.memory
+        self.template = template.records
+
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if self.durability == "interval":
+            self._flusher = threading.Thread(target=self._flush_loop, name="state-store-flusher", daemon=True)
+            self._flusher.start()
+
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._publisher = None
+        if self.shared:
+            self._publisher = threading.Thread(target=self._publish_loop, name="state-store-metrics", daemon=True)
+            self._publisher.start()
+
+    def _new_session_state(self, session_id: str, loaded: Optional[dict] = None, revision: int = 0) -> SessionState:
+        """
+        Build a SessionState from the template, overriding the data of the records found in loaded.
+        """
+        records = copy.deepcopy(self.template)
+        for record, data in (loaded or {}).items():
+            records[record]["data"] = data
+        return SessionState(session_id, self.memory, records, revision)
+
+    def get_session(self, session_id: str = None, create: bool = False) -> SessionState:
+        """
+        Return the state of a session, loading it from the backend if needed.
+
+        Args:
+            session_id (str): Identifier of the session. Defaults to config.DEFAULT_SESSION_ID.
+            create (bool): Create the session from the template if it does not exist.
+
+        Returns:
+            SessionState: The session state.
+
+        Raises:
+            KeyError: If the session does not exist and create is False.
+        """
+        session_id = session_id or config.DEFAULT_SESSION_ID
+        with self.lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+            session = self._evicted.get(session_id)
+
+        created = False
+        if session is None:
+            # Backend I/O runs outside the store lock so it does not hold up the other sessions.
+            # Read the revision before the records: if a save lands in between, the next save is rejected instead of lost
+            revision = self.backend.session_revision(session_id) if self.shared else 0
+            loaded = self.backend.load_session(session_id, list(self.template))
+            if loaded is None:
+                if not create and session_id != config.DEFAULT_SESSION_ID:
+                    raise KeyError(f"Session {session_id} not found.")
+                session = self._new_session_state(session_id, revision=revision)
+                created = True
+            else:
+                session = self._new_session_state(session_id, loaded, revision)
+
+        with self.lock:
+            # Another thread may have loaded the session in the meantime, keep its copy
+            existing = self._lookup(session_id)
+            if existing is not None:
+                session = existing
+            elif created:
+                self._dirty.update((session_id, record) for record in session.records)
+            self._evicted.pop(session_id, None)
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            victims = self._pop_least_recent()
+        self._evict(victims)
+        return session
+
+    def _lookup(self, session_id: str) -> Optional[SessionState]:
+        """
+        Return a loaded session, including a dropped one that is still referenced. Call under self.lock.
+        """
+        return self._sessions.get(session_id) or self._evicted.get(session_id)
+
+    def _pop_least_recent(self) -> List[SessionState]:
+        """
+        Move the sessions beyond max_sessions out of the session table. Call under self.lock.
+
+        Returns:
+            List[SessionState]: The dropped sessions, still to be flushed with _evict.
+        """
+        victims = []
+        while self.max_sessions and len(self._sessions) > self.max_sessions:
+            session_id, session = self._sessions.popitem(last=False)
+            self._evicted[session_id] = session
+            # Checkpoint the journaled records too, the journal is only replayed when the session is loaded again
+            self._dirty.update(key for key in self._journaled if key[0] == session_id)
+            victims.append(session)
+        return victims
+
+    def _evict(self, victims: List[SessionState]):
+        """
+        Write the pending changes of dropped sessions, so they can be loaded again from the backend.
+        """
+        for session in victims:
+            try:
+                self.flush_session(session.session_id)
+            except StateConflictError as e:
+                logger.error(f"Error flushing evicted session {session.session_id}: {e}")
+            logger.debug(f"Evicted session {session.session_id}")
+
+    def create_session(self) -> SessionState:
+        """
+        Create a new session from the template with a random identifier.
+
+        Returns:
+            SessionState: The new session state.
+        """
+        return self.get_session(uuid.uuid4().hex, create=True)
+
+    @contextmanager
+    def transaction(self, session: SessionState):
+        """
+        Hold the lock of a session while it is read and changed.
+
+        With a shared store, the session is first reloaded if another worker saved it since it was
+        loaded, and the records changed in the block are saved together when it exits, checked
+        against the revision the session was loaded at. Nested transactions save with the outermost one.
+
+        Args:
+            session (SessionState): The session to work on.
+
+        Yields:
+            SessionState: The session, up to date with the backend.
+
+        Raises:
+            KeyError: If the session was deleted by another worker.
+            StateConflictError: If another worker saved the session while the block was running.
+        """
+        with session.lock:
+            if not self.shared:
+                yield session
+                return
+            if session.transaction_depth == 0:
+                self._revalidate(session)
+            session.transaction_depth += 1
+            try:
+                yield session
+            finally:
+                session.transaction_depth -= 1
+            if session.transaction_depth == 0:
+                self.flush_session(session.session_id)
+
+    def _revalidate(self, session: SessionState):
+        """
+        Reload the records of a session in place if its backend revision moved.
+
+        The records are replaced inside the existing SessionState, so every SettingsManager bound to
+        it sees the new data, and every record version is bumped to invalidate the derived values.
+        """
+        revision = self.backend.session_revision(session.session_id)
+        if revision == session.revision:
+            return
+        loaded = self.backend.load_session(session.session_id, list(self.template))
+        if loaded is None and session.session_id != config.DEFAULT_SESSION_ID:
+            with self.lock:
+                self._sessions.pop(session.session_id, None)
+                self._evicted.pop(session.session_id, None)
+            raise KeyError(f"Session {session.session_id} not found.")
+
+        fresh = self._new_session_state(session.session_id, loaded, revision)
+        with self.lock:
+            # Unsaved changes were made on top of the old revision, the other worker's version wins
+            self._dirty = {key for key in self._dirty if key[0] != session.session_id}
+            for key in [key for key in self._journaled if key[0] == session.session_id]:
+                del self._journaled[key]
+        for record, entry in fresh.records.items():
+            session.records.setdefault(record, entry)["data"] = entry["data"]
+            session.versions[record] = session.versions.get(record, 0) + 1
+        session.revision = revision
+        metrics.STATE_RELOADS.inc()
+        logger.info(f"Reloaded session {session.session_id} at revision {revision}")
+
+    def mark_dirty(self, session_id: str, record: str):
+        """
+        Mark a record of a session as changed so it gets written to the backend.
+
+        Args:
+            session_id (str): Identifier of the session.
+            record (str): Name of the record that changed.
+        """
+        with self.lock:
+            self._dirty.add((session_id, record))
+            session = self._lookup(session_id)
+            evicted = session is not None and session_id not in self._sessions
+        if evicted:
+            # Nothing keeps a dropped session alive once its holder is done, write the change now
+            self.flush_session(session_id)
+        elif self.shared:
+            # Inside a transaction the record is saved when the transaction exits
+            if session is None or session.transaction_depth == 0:
+                self.flush_session(session_id)
+        elif self.durability == "sync":
+            self.flush()
+
+    def append_item(self, session_id: str, record: str, item: dict):
+        """
+        Record that an item was appended to a record of a session.
+
+        The item is journaled by the backend when it supports it, otherwise the record is marked dirty.
+
+        Args:
+            session_id (str): Identifier of the session.
+            record (str): Name of the record the item was appended to.
+            item (dict): The appended item.
+        """
+        # A journaled item does not bump the revision, other workers would never see it
+        if self.shared or not self.backend.append_item(session_id, record, json.dumps(item)):
+            self.mark_dirty(session_id, record)
+            return
+
+        key = (session_id, record)
+        with self.lock:
+            self._journaled[key] = self._journaled.get(key, 0) + 1
+            checkpoint_due = self._journaled[key] >= config.JOURNAL_CHECKPOINT_EVERY
+            if checkpoint_due:
+                del self._journaled[key]
+                self._dirty.add(key)
+        if checkpoint_due and self.durability == "sync":
+            self.flush()
+
+    def flush(self, checkpoint: bool = False):
+        """
+        Write every dirty record to the backend, batched per session.
+
+        Args:
+            checkpoint (bool): Also rewrite the records that only have journaled changes.
+        """
+        with self.lock:
+            if checkpoint:
+                self._dirty.update(self._journaled)
+            if not self._dirty:
+                return
+            dirty = self._dirty
+            self._dirty = set()
+            # Rewriting a record truncates its journal
+            for key in dirty:
+                self._journaled.pop(key, None)
+
+        by_session: Dict[str, list] = {}
+        for session_id, record in dirty:
+            by_session.setdefault(session_id, []).append(record)
+
+        for session_id, records in by_session.items():
+            with self.lock:
+                session = self._lookup(session_id)
+            if session is None:
+                continue
+            try:
+                self._write(session, records)
+            except StateConflictError as e:
+                # Only a transaction can report the conflict to the request, here the changes are dropped
+                logger.error(f"Error flushing session {session_id}: {e}")
+
+    def flush_session(self, session_id: str):
+        """
+        Write the dirty records of one session to the backend.
+
+        Args:
+            session_id (str): Identifier of the session.
+
+        Raises:
+            StateConflictError: If the store is shared and another worker saved the session first.
+        """
+        with self.lock:
+            records = [record for sid, record in self._dirty if sid == session_id]
+            if not records:
+                return
+            self._dirty.difference_update((session_id, record) for record in records)
+            for record in records:
+                self._journaled.pop((session_id, record), None)
+            session = self._lookup(session_id)
+        if session is not None:
+            self._write(session, records)
+
+    def _write(self, session: SessionState, records: List[str]):
+        """
+        Snapshot records of a session and hand them to the backend.
+        """
+        # Snapshot and write under the session lock: writes of a session can never be reordered,
+        # and no item can be journaled between the snapshot and the write
+        with session.lock:
+            payloads = {
+                record: json.dumps(session.records[record]["data"], indent=4)
+                for record in records
+                if record in session.records
+            }
+            self._save(session, payloads)
+
+    def _save(self, session: SessionState, payloads: Dict[str, str]):
+        """
+        Hand serialized records to the backend, keeping them dirty if the write fails.
+
+        Raises:
+            StateConflictError: If the store is shared and another worker saved the session first.
+        """
+        session_id = session.session_id
+        try:
+            with metrics.span("state_persist"):
+                if not self.shared:
+                    self.backend.save_records(session_id, payloads)
+                elif session.revision is None:
+                    raise StateConflictError(session_id, -1, self.backend.session_revision(session_id))
+                else:
+                    session.revision = self.backend.save_records(session_id, payloads, session.revision)
+        except StateConflictError:
+            # The changes are dropped, the next transaction reloads the session
+            session.revision = None
+            metrics.STATE_CONFLICTS.inc()
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing session {session_id}: {e}")
+            # Keep the records dirty so the next flush retries them
+            with self.lock:
+                self._dirty.update((session_id, record) for record in payloads)
+
+    def _flush_loop(self):
+        """
+        Background loop flushing dirty records every flush_interval seconds.
+        """
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush(checkpoint=True)
+
+    def publish_metrics(self):
+        """
+        Publish the metrics of this worker to the backend, for the /metrics of the other workers.
+        """
+        try:
+            self.backend.publish_metrics(self.worker_id, json.dumps(metrics.REGISTRY.snapshot()))
+        except Exception as e:
+            logger.error(f"Error publishing the metrics of worker {self.worker_id}: {e}")
+
+    def shared_metrics(self) -> List[dict]:
+        """
+        Return the metrics snapshots of every worker, this one up to date.
+
+        Counters and histograms of workers that stopped are kept, so the totals never go back. Gauges
+        are only kept for the workers that published in the last three publication intervals.
+
+        Returns:
+            List[dict]: The snapshots, as returned by MetricsRegistry.snapshot().
+        """
+        own = metrics.REGISTRY.snapshot()
+        snapshots = [own]
+        stale_before = time.time() - 3 * config.METRICS_PUBLISH_INTERVAL
+        for worker, payload in self.backend.load_metrics().items():
+            if worker == self.worker_id:
+                continue
+            try:
+                snapshot = json.loads(payload)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable metrics of worker {worker}")
+                continue
+            if snapshot.get("updated_at", 0) < stale_before:
+                snapshot["metrics"] = {name: metric for name, metric in snapshot["metrics"].items()
+                                       if metric["kind"] != "gauge"}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def _publish_loop(self):
+        """
+        Background loop publishing the metrics of this worker every config.METRICS_PUBLISH_INTERVAL seconds.
+        """
+        while not self._stop_event.wait(config.METRICS_PUBLISH_INTERVAL):
+            self.publish_metrics()
+
+    def close(self):
+        """
+        Stop the background threads, write any pending changes and close the backend.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop_event.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._publisher is not None:
+            self._publisher.join()
+            self.publish_metrics()
+        self.flush(checkpoint=True)
+        self.backend.close()
+
+
+_store: Optional[StateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_state_store(settings_dir: str = "app/settings") -> StateStore:
+    """
+    Return the process-wide StateStore, creating it on first use.
+
+    Args:
+        settings_dir (str): Directory where settings JSON files are stored.
+
+    Returns:
+        StateStore: The shared state store.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = StateStore(settings_dir)
+    return _store
+
+
+def close_state_store():
+    """
+    Flush and close the process-wide StateStore if it was created.
+    """
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
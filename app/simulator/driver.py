@@ -0,0 +1,178 @@
+"""
+Plays simulated games against /next_action/ and reports throughput and latency.
+
+By default the service runs in process with the mock LLM and the in-memory state backend,
+so neither an API key nor a Unity client is needed:
+
+    python -m app.simulator.driver --games 50 --turns 20 --latency 0.5
+
+Pass --url to load an already running server instead, e.g. one started with LLM_ENGINE = "mock".
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+
+# The service modules import each other relative to the app directory, see run.py
+sys.path.append('./app')
+
+from app import config
+from app.simulator.environment import GameEnvironment
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile of a list of values, by nearest rank.
+
+    Parameters:
+    -----------
+    values : list of float
+        The values.
+    q : float
+        The percentile, between 0 and 100.
+
+    Returns:
+    --------
+    float
+        The percentile, 0.0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+async def play_game(client, seed, turns, latencies, outcomes):
+    """
+    Plays one game: starts a session, then sends the result of each action until the game ends.
+
+    Parameters:
+    -----------
+    client : httpx.AsyncClient
+        The client bound to the service.
+    seed : int
+        Seed of the game environment.
+    turns : int
+        Maximum number of turns to play.
+    latencies : list of float
+        Receives the duration of each /next_action/ call, in seconds.
+    outcomes : dict
+        Counters of won, lost and unfinished games and of failed calls, updated in place.
+    """
+    response = await client.post("/start_new_game/")
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+
+    environment = GameEnvironment(seed=seed)
+    for _ in range(turns):
+        start = time.perf_counter()
+        response = await client.post("/next_action/", json=environment.request(session_id))
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            outcomes["errors"] += 1
+            continue
+        action, _ = response.json()
+        environment.step(action)
+        if environment.done:
+            break
+
+    if environment.won:
+        outcomes["won"] += 1
+    elif environment.done:
+        outcomes["lost"] += 1
+    else:
+        outcomes["unfinished"] += 1
+
+
+async def run(games, turns, concurrency, url=None):
+    """
+    Plays games concurrently and measures the /next_action/ calls.
+
+    Parameters:
+    -----------
+    games : int
+        Number of games to play.
+    turns : int
+        Maximum number of turns per game.
+    concurrency : int
+        Number of games played at the same time.
+    url : str, optional
+        Base URL of a running server. The service is run in process when omitted.
+
+    Returns:
+    --------
+    dict
+        The report: outcomes, number of calls, wall time, throughput and latency percentiles in milliseconds.
+    """
+    import httpx
+
+    latencies = []
+    outcomes = {"won": 0, "lost": 0, "unfinished": 0, "errors": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(client, seed):
+        async with semaphore:
+            await play_game(client, seed, turns, latencies, outcomes)
+
+    async def play_all(client):
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(client, seed) for seed in range(games)))
+        return time.perf_counter() - start
+
+    timeout = httpx.Timeout(config.LLM_TIMEOUT + 5)
+    if url is not None:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            elapsed = await play_all(client)
+    else:
+        from app.main import app, lifespan
+
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://simulator", timeout=timeout) as client:
+                elapsed = await play_all(client)
+
+    return {
+        "games": games,
+        "concurrency": concurrency,
+        **outcomes,
+        "calls": len(latencies),
+        "seconds": round(elapsed, 3),
+        "calls_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            name: round(percentile(latencies, q) * 1000, 2)
+            for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play simulated games against /next_action/.")
+    parser.add_argument("--games", type=int, default=10, help="number of games to play")
+    parser.add_argument("--turns", type=int, default=20, help="maximum number of turns per game")
+    parser.add_argument("--concurrency", type=int, default=10, help="games played at the same time")
+    parser.add_argument("--url", help="base URL of a running server, instead of running the service in process")
+    parser.add_argument("--latency", type=float, help="seconds each mock completion takes (in process only)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if args.url is None:
+        # Keep the simulated games away from the LLM providers and from app/settings
+        config.LLM_ENGINE = "mock"
+        config.APPROACH = "ZEROSHOT"
+        config.STATE_BACKEND = "memory"
+        if args.latency is not None:
+            config.MOCK_LLM_LATENCY = args.latency
+
+    report = asyncio.run(run(args.games, args.turns, args.concurrency, args.url))
+    payload = json.dumps(report, indent=2)
+    print(payload)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import random
+from app.helper.utils import load_from_json
+from app.services.action_rules import ActionRules, normalize_item
+
+# Player stat levels, from worst to best
+LEVELS = ["Critical", "Very Low", "Low", "Normal", "Good", "Very Good"]
+
+# Actions adding one of the item named after the prefix, e.g. pick_sticks -> stick
+GATHER_PREFIXES = ("pick_", "mine_", "cut_")
+
+# Results the game sends without a template in messages.json
+EAT_MESSAGE = "You ate some {0}"
+SLEEP_MESSAGE = "You slept and restored your health"
+EXPLORE_MESSAGE = "You explored a new area"
+START_MESSAGE = "You woke up on a remote island"
+
+
+class GameEnvironment:
+    """
+    Offline stand-in for the Unity client.
+
+    Applies the actions chosen by the service to an inventory and player stats, following
+    the recipes of actions.json and the result messages of game_settings/messages.json, and
+    builds the /next_action/ request of the next turn.
+
+    Thirst, hunger and stress drop one level every thirst_every, hunger_every and stress_every
+    turns. Owning a firepit stops stress from rising, and health drops while thirst or hunger
+    is Critical. The game is won by building the raft and lost when health reaches Critical
+    while starving or dehydrated.
+    """
+
+    def __init__(self, seed=None, settings_dir="app/settings", messages_file="app/game_settings/messages.json",
+                 xp_file="app/game_settings/xp.json", thirst_every=3, hunger_every=4, stress_every=5, areas=5):
+        """
+        Initializes a new game.
+
+        Parameters:
+        -----------
+        seed : int, optional
+            Seed of the random events, e.g. berries that have not grown yet. Default is None.
+        settings_dir : str, optional
+            Directory holding actions.json and inventory.json.
+        messages_file : str, optional
+            Path to the result message templates.
+        xp_file : str, optional
+            Path to the experience points granted per result.
+        thirst_every, hunger_every, stress_every : int, optional
+            Turns between two drops of the stat.
+        areas : int, optional
+            Number of areas that can be explored.
+        """
+        self.random = random.Random(seed)
+        self.messages = load_from_json("messages", messages_file)
+        self.xp_table = load_from_json("xp", xp_file)
+        actions = load_from_json("actions", f"{settings_dir}/actions.json")
+        items = [item["name"] for item in load_from_json("inventory", f"{settings_dir}/inventory.json")]
+        self.rules = ActionRules.from_catalogue(actions, items)
+        self.thirst_every = thirst_every
+        self.hunger_every = hunger_every
+        self.stress_every = stress_every
+        self.areas = areas
+
+        self.inventory = {item: 0 for item in items}
+        self.player_info = {stat: "Very Good" for stat in ("health", "hunger", "thirst", "stress")}
+        self.turn = 0
+        self.xp = 0
+        self.explored = 0
+        self.won = False
+        self.done = False
+        self.last = ("start", "success", START_MESSAGE)
+
+    def request(self, session_id=None):
+        """
+        Builds the /next_action/ request reporting the result of the last action.
+
+        Parameters:
+        -----------
+        session_id : str, optional
+            The session the game is played in.
+
+        Returns:
+        --------
+        dict
+            The ActionRequest payload.
+        """
+        action, status, message = self.last
+        payload = {
+            "action": action,
+            "status": status,
+            "message": message,
+            "inventory": dict(self.inventory),
+            "player_info": dict(self.player_info),
+            "xp": str(self.xp),
+        }
+        if session_id is not None:
+            payload["session_id"] = session_id
+        return payload
+
+    def step(self, action):
+        """
+        Performs an action and advances the game by one turn.
+
+        Parameters:
+        -----------
+        action : str
+            The name of the action.
+
+        Returns:
+        --------
+        tuple of (str, str)
+            The status ("success" or "error") and the result message.
+        """
+        key, args = self._apply(action)
+        status = "error" if ".Error" in key or key.startswith(("Error", "CommandNotFound", "Invalid")) else "success"
+        template = self.messages.get(key, key)
+        message = template.format(*args)
+        self.xp += self.xp_table.get(key, 0)
+        self.last = (action, status, message)
+        self._advance()
+        return status, message
+
+    def _apply(self, action):
+        """
+        Changes the inventory and stats for an action.
+
+        Returns:
+        --------
+        tuple of (str, tuple)
+            The messages.json key, or a literal message, and its format arguments.
+        """
+        rule = self.rules.rules.get(action)
+        if rule is None:
+            return "CommandNotFound", ()
+
+        verb, _, target = action.partition("_")
+        item = normalize_item(target, set(self.inventory)) if target else action
+        label = item.capitalize()
+
+        missing_tools = [tool for tool in rule.tools if self.inventory.get(tool, 0) < 1]
+        if missing_tools:
+            if action == "cut_wood":
+                return "wood.cut.ErrorTool", ()
+            return "ErrorTool", (label, missing_tools[0])
+
+        missing = rule.missing(self.inventory)
+        if missing:
+            if verb in ("craft", "build"):
+                return f"{verb}.ErrorMissingItems", (label, ", ".join(missing))
+            return "ErrorNoObject", ("food" if action == "eat" else label,)
+
+        if verb in ("craft", "build"):
+            for ingredient, quantity in rule.ingredients.items():
+                self.inventory[ingredient] -= quantity
+            if item in self.inventory:
+                self.inventory[item] += 1
+            if action in ("craft_torch", "build_firepit"):
+                self._raise("stress", 2)
+            if action == "build_raft":
+                self.won = True
+                self.done = True
+            return f"{verb}.Success", (label,)
+
+        if action == "eat":
+            food = "fish" if self.inventory.get("fish", 0) > 0 else "berry"
+            self.inventory[food] -= 1
+            self.player_info["hunger"] = LEVELS[-1]
+            return EAT_MESSAGE, (food,)
+        if action == "drink":
+            self.player_info["thirst"] = LEVELS[-1]
+            return "drink.Success", ()
+        if action == "sleep":
+            if self.inventory.get("shelter", 0) < 1:
+                return "shelter.ErrorNoObject", ()
+            self.player_info["health"] = LEVELS[-1]
+            return SLEEP_MESSAGE, ()
+        if action == "explore":
+            if self.explored >= self.areas:
+                return "explore.ErrorNoLocation", ()
+            self.explored += 1
+            return EXPLORE_MESSAGE, ()
+        if action == "fish":
+            self.inventory["fish"] += 1
+            return "fish.Success", ()
+        if action == "pick_sail" and self.inventory.get("sail", 0) > 0:
+            return "pick_sail.ErrorNoObject", ()
+        if action == "pick_berries" and self.random.random() < 0.2:
+            return "berry.pick.ErrorHarvestUnready", ()
+
+        if action.startswith(GATHER_PREFIXES) and item in self.inventory:
+            self.inventory[item] += 1
+            if action == "cut_wood":
+                return "wood.cut.Success", ()
+            if verb == "mine":
+                return "collect.Success", (label,)
+            return "pick.Success", (label,)
+        return "interact.Success", (label,)
+
+    def _advance(self):
+        """
+        Moves to the next turn, letting the stats decay.
+        """
+        self.turn += 1
+        if self.turn % self.thirst_every == 0:
+            self._raise("thirst", -1)
+        if self.turn % self.hunger_every == 0:
+            self._raise("hunger", -1)
+        if self.turn % self.stress_every == 0 and self.inventory.get("firepit", 0) < 1:
+            self._raise("stress", -1)
+
+        starving = LEVELS[0] in (self.player_info["thirst"], self.player_info["hunger"])
+        if starving:
+            if self.player_info["health"] == LEVELS[0]:
+                self.done = True
+            self._raise("health", -1)
+
+    def _raise(self, stat, levels):
+        """
+        Moves a stat up (or down, with a negative count) the LEVELS scale.
+        """
+        index = LEVELS.index(self.player_info[stat]) + levels
+        self.player_info[stat] = LEVELS[max(0, min(index, len(LEVELS) - 1))]
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from types import SimpleNamespace
+from app import config
+from services.aiwrapper import AIWrapper
+
+# An action line of the actions section of the prompt: "name: description", or the bare name with the compact encoding
+ACTION_LINE = re.compile(r"^([a-z]+(?:_[a-z]+)*)(?::|$)")
+
+# Characters per streamed chunk
+STREAM_CHUNK_SIZE = 8
+
+
+class MockWrapper(AIWrapper):
+    """
+    Deterministic stand-in for the LLM providers, selected with LLM_ENGINE = "mock".
+
+    It picks one of the actions listed in the prompt from a hash of the messages, so the same
+    prompt always gets the same answer, and waits config.MOCK_LLM_LATENCY seconds to mimic the
+    provider round trip. No API key is needed.
+    """
+    def __init__(self, model, latency=None):
+        """
+        Initializes a new instance of the MockWrapper class.
+
+        Parameters:
+        -----------
+        model : str
+            The name reported for the model.
+        latency : float, optional
+            Seconds each completion takes. Defaults to config.MOCK_LLM_LATENCY.
+        """
+        self.latency = config.MOCK_LLM_LATENCY if latency is None else latency
+        super().__init__(model, 'MOCK_API_KEY')
+
+    def _initialize_client(self):
+        """
+        The mock has no client.
+        """
+        self.client = None
+
+    def _create_completion(self, api_params):
+        """
+        Creates a completion after sleeping for the configured latency.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request.
+
+        Returns:
+        --------
+        SimpleNamespace
+            A response shaped like the OpenAI chat completion.
+        """
+        time.sleep(self.latency)
+        return self._respond(api_params)
+
+    async def _acreate_completion(self, api_params):
+        """
+        Creates a completion after sleeping for the configured latency, without blocking the event loop.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request.
+
+        Returns:
+        --------
+        SimpleNamespace
+            A response shaped like the OpenAI chat completion.
+        """
+        await asyncio.sleep(self.latency)
+        return self._respond(api_params)
+
+    async def _astream_completion(self, api_params):
+        """
+        Streams the completion in small chunks, the first one arriving after half the configured latency.
+
+        Parameters:
+        -----------
+        api_params : dict
+            The parameters for the completion request, with stream set.
+
+        Returns:
+        --------
+        AsyncIterator
+            Chunks shaped like the OpenAI chat completion chunks, the usage on the last one.
+        """
+        response = self._respond(api_params)
+        content = response.choices[0].message.content
+        pieces = [content[index:index + STREAM_CHUNK_SIZE] for index in range(0, len(content), STREAM_CHUNK_SIZE)]
+        await asyncio.sleep(self.latency / 2)
+        for piece in pieces:
+            delta = SimpleNamespace(role="assistant", content=piece)
+            yield SimpleNamespace(model=self.model, choices=[SimpleNamespace(index=0, delta=delta)], usage=None)
+            await asyncio.sleep(self.latency / 2 / len(pieces))
+        yield SimpleNamespace(model=self.model, choices=[], usage=response.usage)
+
+    def _respond(self, api_params):
+        """
+        Chooses the action and builds the response.
+        """
+        prompt = "\n".join(message["content"] for message in api_params["messages"])
+        actions = self._listed_actions(prompt)
+        digest = hashlib.sha256(f"{config.MOCK_LLM_SEED}:{prompt}".encode()).digest()
+        action = actions[int.from_bytes(digest[:4], "big") % len(actions)] if actions else "explore"
+        content = json.dumps({"action": action, "observation": f"I will {action.replace('_', ' ')}."})
+        usage = SimpleNamespace(
+            prompt_tokens=len(prompt) // 4,
+            completion_tokens=len(content) // 4,
+            prompt_tokens_details=None,
+        )
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(model=self.model, choices=[SimpleNamespace(index=0, message=message)], usage=usage)
+
+    def _listed_actions(self, prompt):
+        """
+        Returns the names of the actions listed in the actions section of the prompt.
+        """
+        actions = []
+        in_actions = False
+        for line in prompt.splitlines():
+            if line.startswith("Actions"):
+                in_actions = True
+                continue
+            if in_actions:
+                if line.startswith("{"):
+                    # PROMPT_ENCODING = "json": the actions are the keys of one JSON object
+                    return list(json.loads(line))
+                match = ACTION_LINE.match(line)
+                if not match:
+                    break
+                actions.append(match.group(1))
+        return actions
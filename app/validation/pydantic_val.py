@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
+
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
 
 class Inventory(BaseModel):
     axe: int
@@ -32,6 +35,7 @@ class ActionRequest(BaseModel):
     inventory: Inventory
     player_info: PlayerInfo
     xp:     str
+    session_id: Optional[str] = Field(default=None, pattern=SESSION_ID_PATTERN)
 
 class NextAction(BaseModel):
     action: str
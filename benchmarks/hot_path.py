@@ -0,0 +1,290 @@
+"""
+Times each stage of a /next_action/ turn and compares the results with a saved baseline.
+
+The stages are timed in process on a copy of app/settings, for several log sizes and
+inventory sizes. The endpoint round trip uses the mock LLM engine with no latency and the
+in-memory state backend, so no API key is needed. The tiktoken encoding files must be
+available locally, stages that need them are reported as skipped otherwise.
+
+    python benchmarks/hot_path.py                          # print the results as JSON
+    python benchmarks/hot_path.py --save-baseline          # store them in benchmarks/baseline.json
+    python benchmarks/hot_path.py --compare                # exit with 1 if a stage got slower than the baseline
+
+The baseline is machine specific, record it on the machine the comparison runs on.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# The service modules import each other relative to the app directory, see run.py
+sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+os.chdir(ROOT)
+
+from app import config
+from app.helper import tokens
+from app.settings.backends import MemoryBackend
+from app.settings.settings_manager import SettingsManager
+from app.settings.state_store import StateStore
+from app.simulator.environment import GameEnvironment
+from app.validation.pydantic_val import ActionRequest, NextAction
+
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+LOG_SIZES = [8, 32, 128]
+EXTRA_ITEMS = [0, 50, 200]
+
+
+def measure(stage, number, repeat):
+    """
+    Times a stage.
+
+    Parameters:
+    -----------
+    stage : callable
+        The stage, called without arguments.
+    number : int
+        Calls per measurement.
+    repeat : int
+        Number of measurements.
+
+    Returns:
+    --------
+    dict
+        The median and minimum time per call, in microseconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            stage()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    return {"median_us": round(statistics.median(samples), 3), "min_us": round(min(samples), 3)}
+
+
+def sized_settings(directory, logs_size, extra_items):
+    """
+    Copies app/settings to a directory, with full logs and extra inventory items.
+
+    Parameters:
+    -----------
+    directory : Path
+        The destination directory.
+    logs_size : int
+        Number of log entries to write.
+    extra_items : int
+        Number of inventory items to add to the default ones.
+    """
+    shutil.copytree("app/settings", directory, ignore=shutil.ignore_patterns("sessions", "*.db", "*.journal", "*.py", "__pycache__"))
+    logs = json.loads((directory / "logs.json").read_text())["logs"]
+    logs = (logs * (logs_size // max(len(logs), 1) + 1))[:logs_size]
+    (directory / "logs.json").write_text(json.dumps({"logs": logs}, indent=4))
+
+    inventory = json.loads((directory / "inventory.json").read_text())["inventory"]
+    inventory += [
+        {"name": f"item_{index}", "description": f"item {index} is used to craft other items", "quantity": index % 5}
+        for index in range(extra_items)
+    ]
+    (directory / "inventory.json").write_text(json.dumps({"inventory": inventory}, indent=4))
+
+
+def stage_timings(logs_size, extra_items, number, repeat):
+    """
+    Times the in-process stages of a turn for one state size.
+
+    Returns:
+    --------
+    dict
+        The timings keyed by stage name. Stages that could not run hold the reason instead.
+    """
+    config.LOGS_SIZE = logs_size
+    request_payload = GameEnvironment(seed=0).request()
+    request = ActionRequest.model_validate(request_payload)
+    response = json.dumps({"action": "drink", "observation": "I am thirsty, I will drink some water."})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings_dir = Path(tmp) / "settings"
+        sized_settings(settings_dir, logs_size, extra_items)
+        store = StateStore(str(settings_dir), durability="on_shutdown", backend=MemoryBackend())
+        try:
+            settings_manager = SettingsManager(str(settings_dir), store=store)
+
+            def render_cold():
+                for record in settings_manager.records:
+                    settings_manager._touch(record)
+                return settings_manager.all_records_to_string()
+
+            stages = {
+                "action_request_validation": lambda: ActionRequest.model_validate(request_payload),
+                "settings_manager_from_disk": lambda: SettingsManager(str(settings_dir)),
+                "settings_manager_from_store": lambda: SettingsManager(str(settings_dir), store=store),
+                "update_objectives": lambda: settings_manager.updateObjectives(request.inventory),
+                "update_memory": lambda: settings_manager.update_memory(request),
+                "all_records_to_string_cold": render_cold,
+                "all_records_to_string_cached": settings_manager.all_records_to_string,
+                "num_tokens_full_prompt": lambda: tokens.num_tokens(settings_manager.all_records_to_string()),
+                "prompt_tokens_cached": settings_manager.prompt_tokens,
+                "next_action_validation": lambda: NextAction.model_validate_json(response),
+            }
+
+            results = {}
+            for name, stage in stages.items():
+                try:
+                    results[name] = measure(stage, number, repeat)
+                except Exception as e:
+                    results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+            results["prompt_chars"] = len(settings_manager.all_records_to_string())
+            return results
+        finally:
+            store.close()
+
+
+def endpoint_timings(logs_size, number, repeat):
+    """
+    Times full /next_action/ round trips through an in-process ASGI client with the mock LLM.
+
+    Returns:
+    --------
+    dict
+        The timing of one round trip, or the reason it could not run.
+    """
+    import httpx
+
+    config.LOGS_SIZE = logs_size
+    config.LLM_ENGINE = "mock"
+    config.MOCK_LLM_LATENCY = 0.0
+    config.APPROACH = "ZEROSHOT"
+    config.STATE_BACKEND = "memory"
+    from app.main import app, lifespan
+
+    async def run():
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                session_id = (await client.post("/start_new_game/")).json()["session_id"]
+                environment = GameEnvironment(seed=0)
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    for _ in range(number):
+                        response = await client.post("/next_action/", json=environment.request(session_id))
+                        response.raise_for_status()
+                    samples.append((time.perf_counter() - start) / number * 1e6)
+                return {"median_us": round(statistics.median(samples), 3), "min_us": round(min(samples), 3)}
+
+    try:
+        return asyncio.run(run())
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+
+def run_suite(number, repeat, log_sizes, extra_items):
+    """
+    Runs every stage for every state size.
+
+    Returns:
+    --------
+    dict
+        The environment and the results keyed by case ("logs=8,items=0") then stage.
+    """
+    original = {name: getattr(config, name) for name in ("LOGS_SIZE", "LLM_ENGINE", "MOCK_LLM_LATENCY", "APPROACH", "STATE_BACKEND")}
+    cases = {}
+    try:
+        for logs_size in log_sizes:
+            for extra in extra_items:
+                cases[f"logs={logs_size},items={extra}"] = stage_timings(logs_size, extra, number, repeat)
+            cases[f"logs={logs_size},items={extra_items[0]}"]["endpoint_round_trip"] = endpoint_timings(
+                logs_size, max(1, number // 10), repeat)
+    finally:
+        for name, value in original.items():
+            setattr(config, name, value)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "number": number,
+        "repeat": repeat,
+        "cases": cases,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the median timings with a baseline.
+
+    Parameters:
+    -----------
+    results : dict
+        The current results.
+    baseline : dict
+        The saved results.
+    tolerance : float
+        Allowed slowdown, e.g. 0.25 for 25%.
+
+    Returns:
+    --------
+    list of dict
+        One entry per stage timed in both runs, with the ratio and whether it regressed.
+    """
+    comparison = []
+    for case, stages in results["cases"].items():
+        for stage, timing in stages.items():
+            previous = baseline.get("cases", {}).get(case, {}).get(stage)
+            if not isinstance(timing, dict) or not isinstance(previous, dict):
+                continue
+            if "median_us" not in timing or "median_us" not in previous or not previous["median_us"]:
+                continue
+            ratio = timing["median_us"] / previous["median_us"]
+            comparison.append({
+                "case": case,
+                "stage": stage,
+                "baseline_us": previous["median_us"],
+                "current_us": timing["median_us"],
+                "ratio": round(ratio, 3),
+                "regressed": ratio > 1 + tolerance,
+            })
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the /next_action/ hot path.")
+    parser.add_argument("--number", type=int, default=200, help="calls per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements per stage")
+    parser.add_argument("--logs", type=int, nargs="+", default=LOG_SIZES, help="log sizes to benchmark")
+    parser.add_argument("--items", type=int, nargs="+", default=EXTRA_ITEMS, help="extra inventory items to benchmark")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a stage counts as regressed")
+    parser.add_argument("--output", type=Path, help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.INFO)
+
+    report = {"results": run_suite(args.number, args.repeat, args.logs, args.items)}
+    regressed = []
+    if args.compare:
+        if not args.baseline.exists():
+            parser.error(f"No baseline at {args.baseline}, record one with --save-baseline first.")
+        report["comparison"] = compare(report["results"], json.loads(args.baseline.read_text()), args.tolerance)
+        regressed = [entry for entry in report["comparison"] if entry["regressed"]]
+
+    payload = json.dumps(report, indent=2)
+    print(payload)
+    if args.output:
+        args.output.write_text(payload)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report["results"], indent=2))
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
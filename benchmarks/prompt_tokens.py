@@ -0,0 +1,129 @@
+"""
+Compares the prompt size of each PROMPT_ENCODING, for both PROMPT_LAYOUT values.
+
+The prompt is built from the records of a settings directory (app/settings by default) and
+counted with the same num_tokens as the service, so the tiktoken encoding files must be
+available locally. Nothing is written to the settings directory.
+
+    python benchmarks/prompt_tokens.py
+    python benchmarks/prompt_tokens.py --prefilter --output prompt_tokens.json
+
+For each layout and encoding the report gives the tokens of every message, of the whole
+prompt, of each record section, and the saving compared with the verbose encoding. With the
+split layout, the tokens of the dynamic message are the ones paid in full on every turn.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# The service modules import each other relative to the app directory, see run.py
+sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+os.chdir(ROOT)
+
+from app import config
+from app.helper import tokens
+from app.services.prompt_encoding import ENCODINGS
+from app.settings.settings_manager import SettingsManager
+
+LAYOUTS = ["single", "split"]
+
+
+def measure(settings_manager, layout, encoding):
+    """
+    Counts the tokens of the prompt for one layout and encoding.
+
+    Parameters:
+    -----------
+    settings_manager : SettingsManager
+        The manager holding the records.
+    layout : str
+        The PROMPT_LAYOUT to measure.
+    encoding : str
+        The PROMPT_ENCODING to measure.
+
+    Returns:
+    --------
+    dict
+        The characters and tokens of each message and of the whole prompt, and the tokens of each record section.
+    """
+    config.PROMPT_LAYOUT = layout
+    config.PROMPT_ENCODING = encoding
+    messages = settings_manager.prompt_messages()
+    with_description = layout == "single" and encoding == "verbose"
+    return {
+        "messages": [
+            {
+                "role": message["role"],
+                "chars": len(message["content"]),
+                "tokens": settings_manager.num_tokens(message["content"]),
+            }
+            for message in messages
+        ],
+        "chars": sum(len(message["content"]) for message in messages),
+        "tokens": sum(settings_manager.num_tokens(message["content"]) for message in messages),
+        "estimated_tokens": settings_manager.prompt_tokens(),
+        "records": {
+            record: settings_manager.record_tokens(record, with_description=with_description)
+            for record in settings_manager.records
+        },
+    }
+
+
+def report(settings_dir, prefilter=False):
+    """
+    Measures every layout and encoding.
+
+    Parameters:
+    -----------
+    settings_dir : str
+        The directory holding memory.json and the records.
+    prefilter : bool, optional
+        Measure with ACTION_PREFILTER on.
+
+    Returns:
+    --------
+    dict
+        The measures keyed by layout then encoding, with the saving over the verbose encoding of the same layout.
+    """
+    original = {name: getattr(config, name) for name in ("PROMPT_LAYOUT", "PROMPT_ENCODING", "ACTION_PREFILTER")}
+    config.ACTION_PREFILTER = prefilter
+    settings_manager = SettingsManager(settings_dir)
+    results = {}
+    try:
+        for layout in LAYOUTS:
+            results[layout] = {encoding: measure(settings_manager, layout, encoding) for encoding in ENCODINGS}
+            verbose = results[layout]["verbose"]
+            for measures in results[layout].values():
+                measures["saving"] = round(1 - measures["tokens"] / verbose["tokens"], 3) if verbose["tokens"] else 0.0
+                # The last message of the split layout is the part that changes on every turn
+                measures["saving_per_turn"] = (
+                    round(1 - measures["messages"][-1]["tokens"] / verbose["messages"][-1]["tokens"], 3)
+                    if verbose["messages"][-1]["tokens"] else 0.0
+                )
+    finally:
+        for name, value in original.items():
+            setattr(config, name, value)
+    return {"settings_dir": str(settings_dir), "model": tokens.default_model(), "prefilter": prefilter, "layouts": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the prompt tokens of each PROMPT_ENCODING.")
+    parser.add_argument("--settings", default="app/settings", help="settings directory holding the records")
+    parser.add_argument("--prefilter", action="store_true", help="measure with ACTION_PREFILTER on")
+    parser.add_argument("--output", type=Path, help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.INFO)
+
+    payload = json.dumps(report(args.settings, args.prefilter), indent=2)
+    print(payload)
+    if args.output:
+        args.output.write_text(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measures the cold start of the service, with and without the lifespan warm-up.
+
+Each mode runs in a fresh interpreter, so nothing is already imported or cached. The service
+uses the mock LLM engine with no latency and the in-memory state backend, so the numbers are
+the cost of the service itself: importing app.main, starting up, and the first requests.
+
+    python benchmarks/startup.py --output startup.json
+
+For each mode the report gives the import time, the startup time, the latency of the first
+and second /next_action/ calls, and the startup profile served by /startup/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def child(warmup):
+    """
+    Starts the service in process and prints the measures as JSON.
+    """
+    sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+    os.chdir(ROOT)
+
+    import logging
+    logging.disable(logging.INFO)
+
+    from app import config
+    config.LLM_ENGINE = "mock"
+    config.MOCK_LLM_LATENCY = 0.0
+    config.APPROACH = "ZEROSHOT"
+    config.STATE_BACKEND = "memory"
+    config.WARMUP_ENABLED = warmup
+
+    start = time.perf_counter()
+    from app.main import app, lifespan
+    imported = time.perf_counter() - start
+
+    import httpx
+    from app.simulator.environment import GameEnvironment
+
+    async def run():
+        start = time.perf_counter()
+        async with lifespan(app):
+            started = time.perf_counter() - start
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+                session_id = (await client.post("/start_new_game/")).json()["session_id"]
+                environment = GameEnvironment(seed=0)
+                latencies = []
+                for _ in range(2):
+                    request_start = time.perf_counter()
+                    response = await client.post("/next_action/", json=environment.request(session_id))
+                    latencies.append(time.perf_counter() - request_start)
+                    response.raise_for_status()
+                profile = (await client.get("/startup/")).json()
+        return started, latencies, profile
+
+    started, latencies, profile = asyncio.run(run())
+    print(json.dumps({
+        "import_ms": round(imported * 1000, 2),
+        "startup_ms": round(started * 1000, 2),
+        "first_request_ms": round(latencies[0] * 1000, 2),
+        "second_request_ms": round(latencies[1] * 1000, 2),
+        "profile": profile,
+    }))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start of the service.")
+    parser.add_argument("--output", type=Path, help="also write the JSON report to this file")
+    parser.add_argument("--child", choices=["warm", "cold"], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child == "warm")
+        return
+
+    report = {}
+    for mode in ("cold", "warm"):
+        result = subprocess.run(
+            [sys.executable, __file__, "--child", mode],
+            capture_output=True, text=True, cwd=ROOT,
+        )
+        if result.returncode != 0:
+            report[mode] = {"error": result.stderr.strip().splitlines()[-1:]}
+            continue
+        report[mode] = json.loads(result.stdout.strip().splitlines()[-1])
+
+    payload = json.dumps(report, indent=2)
+    print(payload)
+    if args.output:
+        args.output.write_text(payload)
+
+
+if __name__ == "__main__":
+    main()